@@ -0,0 +1,61 @@
+"""
+How well gorilla encoding compresses buffered metrics: sealed store blocks
+against the arrays they replace, and a series on the wire against JSON.
+
+Run from the repository root with: python bench/gorilla_ratio.py
+"""
+
+import os
+import random
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from doppler.agent import gorilla
+from doppler.agent.collector import SealedBlock
+from doppler.agent.payload import PayloadSection
+
+def cpu_series(generator, count):
+    "A percentage wandering about, as cpu and disk utilisation do."
+
+    value = generator.uniform(0, 100)
+    values = []
+    for i in range(count):
+        value = min(100.0, max(0.0, value + generator.gauss(0, 2)))
+        values.append(round(value, 2))
+    return values
+
+def store_blocks(generator, series_count=8, samples=512, interval=5):
+    timestamps, ids, values = array("l"), array("l"), array("d")
+    series = [cpu_series(generator, samples) for _ in range(series_count)]
+    for i in range(samples):
+        for name_id in range(series_count):
+            timestamps.append(1400000000 + i * interval)
+            ids.append(name_id)
+            values.append(series[name_id][i])
+
+    block = SealedBlock(0, timestamps, ids, values)
+    raw = (timestamps.itemsize + ids.itemsize + values.itemsize) * block.count
+    print "Sealed block, %d series of %d samples:" % (series_count, samples)
+    print "  arrays   %8d bytes, %5.1f bytes/sample" % (raw, float(raw) / block.count)
+    print "  gorilla  %8d bytes, %5.1f bytes/sample (%.1fx)" % (block.size, float(block.size) / block.count, float(raw) / block.size)
+
+def wire_format(generator, samples=360, interval=10):
+    values = dict(zip(range(1400000000, 1400000000 + samples * interval, interval), cpu_series(generator, samples)))
+    as_json = len(PayloadSection().values_json(values))
+    as_gorilla = len(PayloadSection(wire_format="gorilla").values_json(values))
+    print "Wire format, one series of %d samples:" % samples
+    print "  json     %8d bytes" % as_json
+    print "  gorilla  %8d bytes (%.1fx)" % (as_gorilla, float(as_json) / as_gorilla)
+
+def constant_series(samples=4096):
+    data = gorilla.encode(range(0, samples * 5, 5), [1.0] * samples)
+    print "Constant series, regular timestamps:"
+    print "  gorilla  %8d bytes, %5.2f bits/sample" % (len(data), 8.0 * len(data) / samples)
+
+if __name__ == "__main__":
+    generator = random.Random(14)
+    store_blocks(generator)
+    wire_format(generator)
+    constant_series()
@@ -0,0 +1,112 @@
+"""
+How long building and serialising a payload takes for backlogs of
+different sizes, in CPU time, and what it allocates: the objects the built
+payload holds on to, and the growth in peak RSS while building and
+serialising it. Compared against the nested defaultdict merging it
+replaced. Each case runs in its own process, so their peaks are separate.
+
+Run from the repository root with: python bench/payload_build.py
+"""
+
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from doppler.agent.payload import Payload
+
+SERIES = 30
+HEADER = {"apiKey": "key", "machineId": "id", "hostname": "host"}
+
+def samples(count):
+    return [(1400000000 + i // SERIES, "metric.%d" % (i % SERIES), float(i % 100)) for i in range(count)]
+
+# The collector's previous payload building, kept here as the baseline
+
+def deep_update_dict(destination, source):
+    for k,v in source.items():
+        if isinstance(v, dict):
+            if not k in destination or not isinstance(destination[k], dict):
+                destination[k] = {}
+            deep_update_dict(destination[k], v)
+        else:
+            destination[k] = v
+    return destination
+
+def add_ts_values(payload, values):
+    func = lambda: defaultdict(func)
+    generated = defaultdict(func)
+    for m in values:
+        ts, name, value = m
+        generated[name]["values"][ts] = value
+    return deep_update_dict(payload, generated)
+
+def build_baseline(items, metadata, wire_format):
+    payload = {}
+    deep_update_dict(payload, metadata)
+    add_ts_values(payload, items)
+    return payload
+
+def serialise_baseline(payload):
+    body = dict(HEADER)
+    body.update({"metrics": payload, "states": {}, "events": {}})
+    return json.dumps(body)
+
+def build(items, metadata, wire_format):
+    payload = Payload(wire_format)
+    payload.metrics.describe(metadata)
+    payload.metrics.add(items)
+    return payload
+
+def serialise(payload):
+    return payload.to_json(HEADER)
+
+CASES = {
+    "baseline": (build_baseline, serialise_baseline, "json"),
+    "json": (build, serialise, "json"),
+    "gorilla": (build, serialise, "gorilla"),
+}
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0)
+
+def objects_held(build, items, metadata, wire_format):
+    "How many gc-tracked objects the built payload holds on to."
+
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        payload = build(items, metadata, wire_format)
+        return len(gc.get_objects()) - before
+    finally:
+        gc.enable()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        name, count = sys.argv[1], int(sys.argv[2])
+        build_payload, serialise_payload, wire_format = CASES[name]
+        metadata = dict(("metric.%d" % i, {"title": "Metric %d" % i, "unit": "%"}) for i in range(SERIES))
+        items = samples(count)
+
+        before = peak_rss_mb()
+        objects = objects_held(build_payload, items, metadata, wire_format)
+        runs = max(1, 100000 // count)
+        start = time.clock()
+        for i in range(runs):
+            size = len(serialise_payload(build_payload(items, metadata, wire_format)))
+        duration = (time.clock() - start) * 1000 / runs
+        print "%-8s %6d samples: %7.2fms, %7d objects, %6.1fMB peak, %8d bytes" % (name, count, duration, objects, peak_rss_mb() - before, size)
+    else:
+        for count in ("1000", "10000", "100000"):
+            for name in ("baseline", "json", "gorilla"):
+                subprocess.check_call([sys.executable, __file__, name, count])
+            print
@@ -0,0 +1,63 @@
+"""
+What reading a /proc file through a kept-open ProcFile costs against
+opening it each time, and what each Linux /proc provider costs per tick,
+reading and parsing only: metric() and state() are stubbed out, so the
+stores don't count.
+
+Run from the repository root, on Linux, with: python bench/proc_providers.py
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from doppler.agent.providers import ProcFile
+from doppler.agent.providers.linux import system
+
+logging.getLogger("doppler").setLevel(logging.WARNING)
+
+PROVIDERS = ("meminfo", "cpustat", "diskstats", "netdev", "processes", "filesystems", "cgroups")
+
+def ignore(name, value):
+    pass
+
+def bench_read(path, reads=10000):
+    start = time.time()
+    for i in range(reads):
+        with open(path) as f:
+            f.read()
+    opened = (time.time() - start) / reads * 1e6
+
+    proc_file = ProcFile(path)
+    start = time.time()
+    for i in range(reads):
+        proc_file.read()
+    kept_open = (time.time() - start) / reads * 1e6
+    proc_file.close()
+
+    return (opened, kept_open)
+
+def bench(provider_class, ticks):
+    provider = provider_class(None, None, None, None)
+    provider.metric = provider.state = ignore
+
+    # Warm up, so files are open and previous samples are there to compare against
+    for i in range(3):
+        provider.tick(i)
+
+    start = time.time()
+    for i in range(ticks):
+        provider.tick(i)
+    return (time.time() - start) / ticks * 1e6
+
+if __name__ == "__main__":
+    for path in ("/proc/stat", "/proc/meminfo", "/proc/self/mountinfo"):
+        print "%-22s open() %6.1f us/read, ProcFile %6.1f us/read" % ((path,) + bench_read(path))
+    print
+
+    for name in PROVIDERS:
+        ticks = 300 if name in ("processes", "cgroups") else 3000
+        print "%-12s %8.1f us/tick" % (name, bench(getattr(system, name), ticks))
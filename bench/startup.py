@@ -0,0 +1,55 @@
+"""
+How long the agent takes to start collecting: importing the collector,
+building a Collector and resolving the active providers. Each run is a
+fresh interpreter, so nothing is already imported; the median is reported,
+along with the slowest imports of the last run.
+
+Run from the repository root with: python bench/startup.py [runs]
+"""
+
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+STARTUP = """
+import time, sys, __builtin__
+sys.path.insert(0, %r)
+original_import = __builtin__.__import__
+depth = [0]
+imports = []
+
+def timed_import(name, *args, **kwargs):
+    if name in sys.modules:
+        return original_import(name, *args, **kwargs)
+    depth[0] += 1
+    start = time.time()
+    try:
+        return original_import(name, *args, **kwargs)
+    finally:
+        depth[0] -= 1
+        imports.append((depth[0], name, (time.time() - start) * 1000))
+
+__builtin__.__import__ = timed_import
+start = time.time()
+from doppler.agent.collector import Collector
+Collector("key", "machine", "host").active_providers()
+print (time.time() - start) * 1000
+for level, name, duration in imports:
+    if level == 0 and duration >= 1:
+        print "%%s %%.1f" %% (name, duration)
+"""
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    times = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", STARTUP % ROOT]).splitlines()
+        times.append(float(output[0]))
+
+    print "Startup over %d runs: median %.1fms, min %.1fms" % (runs, sorted(times)[runs // 2], min(times))
+    print "Imports taking 1ms or more in the last run:"
+    for line in output[1:]:
+        name, duration = line.rsplit(" ", 1)
+        print "  %-40s %6sms" % (name, duration)
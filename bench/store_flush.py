@@ -0,0 +1,36 @@
+"""
+How long draining a ValueStore backlog takes: get_completed() up to a
+timestamp cutoff, then acknowledge() of everything returned.
+
+Run from the repository root with: python bench/store_flush.py
+"""
+
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from doppler.agent.collector import ValueStore
+
+logging.getLogger("doppler").setLevel(logging.WARNING)
+
+def fill(store, count, series=30):
+    for i in range(count):
+        store.collect("metric.%d" % (i % series), i, ts=1400000000 + i // series)
+
+def flush(store, before):
+    start = time.time()
+    seq, items = store.get_completed(before)
+    store.acknowledge(seq + len(items))
+    return (time.time() - start) * 1000, len(items)
+
+if __name__ == "__main__":
+    for count in (10000, 100000):
+        for numeric in (False, True):
+            store = ValueStore(numeric=numeric)
+            fill(store, count)
+            before = 1400000000 + count // 30
+            duration, sent = flush(store, before)
+            print "%7d items, %-7s store: flushed %7d in %7.2fms" % (count, "numeric" if numeric else "plain", sent, duration)
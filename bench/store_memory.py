@@ -0,0 +1,47 @@
+"""
+How much memory buffering a backlog of samples takes: a plain list of
+(ts, name, value) tuples against the numeric ValueStore. Each case runs
+in its own process and reports the growth in its peak RSS.
+
+Run from the repository root with: python bench/store_memory.py [samples]
+"""
+
+import logging
+import os
+import resource
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from doppler.agent.collector import ValueStore
+
+logging.getLogger("doppler").setLevel(logging.WARNING)
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024 if sys.platform == "darwin" else 1024.0)
+
+def fill_list(count):
+    items = []
+    for i in range(count):
+        items.append((1400000000 + i, "system.disk.utilization:sda", str(i % 100)))
+    return items
+
+def fill_store(count):
+    store = ValueStore(numeric=True)
+    for i in range(count):
+        store.collect("system.disk.utilization:sda", str(i % 100), ts=1400000000 + i)
+    return store
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        case, count = sys.argv[1], int(sys.argv[2])
+        before = peak_rss_mb()
+        kept = (fill_list if case == "list" else fill_store)(count)
+        print "%-6s %8d samples: %6.1fMB" % (case, count, peak_rss_mb() - before)
+    else:
+        count = sys.argv[1] if len(sys.argv) > 1 else "1000000"
+        for case in ("list", "store"):
+            subprocess.check_call([sys.executable, __file__, case, count])
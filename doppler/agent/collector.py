@@ -1,64 +1,325 @@
+import os
 import platform
+import random
+import sys
 import time
-import urllib2
-import json
+import zlib
+from array import array
+from bisect import bisect_left
 from threading import Thread, Lock
-from collections import defaultdict
 from copy import copy, deepcopy
 
-from doppler.utils import logger
-from doppler.agent.providers import get_providers_from_packages
-import doppler.agent.providers.common
-import doppler.agent.providers.mac
-import doppler.agent.providers.linux
+from doppler.utils import logger, gzip_chunks
+from doppler.agent import gorilla
+from doppler.agent.providers import get_providers_from_manifest, coerce_setting, PROVIDER_METRICS
+from doppler.agent.scheduler import Scheduler
+from doppler.agent.reactor import CommandReactor
+from doppler.agent.spool import Spool
+from doppler.agent.payload import Payload
+from doppler.agent.profiling import Profiler
+from doppler.agent.rollup import Rollups
+from doppler.agent.transport import HttpTransport, Backoff
+
+class SealedBlock(object):
+    """
+    A run of items from a numeric ValueStore, compressed with gorilla
+    encoding per series, plus the order the series' items were collected in.
+    """
+
+    def __init__(self, first_seq, timestamps, ids, values):
+        self.first_seq = first_seq
+        self.count = len(ids)
+        self.end_seq = first_seq + self.count
+
+        self.order = zlib.compress(ids.tostring())
+
+        series = {}
+        for ts, name_id, value in zip(timestamps, ids, values):
+            if name_id not in series:
+                series[name_id] = ([], [])
+            series[name_id][0].append(ts)
+            series[name_id][1].append(value)
+        self.series = dict((name_id, gorilla.encode(*points)) for name_id, points in series.items())
+        self.size = len(self.order) + sum(len(data) for data in self.series.values())
+
+    def decode(self):
+        "Decode the block back into lists of timestamps, name ids and values."
+
+        ids = array("l")
+        ids.fromstring(zlib.decompress(self.order))
+
+        series = dict((name_id, gorilla.decode(data)) for name_id, data in self.series.items())
+        positions = dict.fromkeys(series, 0)
+
+        timestamps = []
+        values = []
+        for name_id in ids:
+            position = positions[name_id]
+            positions[name_id] = position + 1
+            timestamps.append(series[name_id][0][position])
+            values.append(series[name_id][1][position])
+
+        return (timestamps, ids, values)
 
 class ValueStore:
-    def __init__(self, de_dupe=False):
+    """
+    Time ordered store of collected items.
+
+    Items are kept in the order they were collected, as parallel arrays of
+    timestamps, interned name ids and values. Numeric stores keep their
+    values in a typed array too, converting them to floats as they are
+    collected, and once a backlog builds up they compress their oldest items
+    into sealed blocks. Every item has a sequence number, which is its
+    offset from the start of the store, so a transmission can acknowledge
+    everything it sent with a single number rather than searching for each
+    sent item.
+    """
+
+    # Only compact the consumed head of the store once it is this large
+    COMPACT_THRESHOLD = 1024
+
+    # Numeric stores seal this many items into a compressed block at a time,
+    # once twice as many are waiting to be sent
+    SEAL_ITEMS = 4096
+
+    def __init__(self, de_dupe=False, spool=None, numeric=False, rollups=None):
         self.lock = Lock()
-        self.items = []
         self.de_dupe = de_dupe
         self.last_state = {}
+        self.numeric = numeric
+
+        # Optional incremental aggregates of the collected values
+        self.rollups = rollups
+
+        # Interned item names
+        self.names = []
+        self.name_ids = {}
+
+        self.timestamps = array("l")
+        self.ids = array("l")
+        self.values = array("d") if numeric else []
 
-    def register(self, event):
-        self.collect(event, None)
+        # Index of the first unacknowledged item, and the sequence number of
+        # the first item in the arrays
+        self.head = 0
+        self.base_seq = 0
 
-    def collect(self, name, value, force_collection=False):
+        # Sealed blocks of older items, which come before the arrays, and the
+        # sequence number of the first unacknowledged item within them
+        self.blocks = []
+        self.blocks_seq = 0
+        self.decoded_block = None
+
+        # Optional on-disk copy of the store, replayed on startup
+        self.spool = spool
+        if self.spool:
+            self.base_seq, items = self.spool.replay()
+            for ts, name, value in items:
+                self.append(ts, name, value)
+                self.last_state[name] = value
+            self.seal()
+
+    def __len__(self):
+        with self.lock:
+            return self.base_seq + len(self.timestamps) - self.first_seq()
+
+    def size(self):
+        "Roughly how many bytes the items held in memory take up."
+
+        with self.lock:
+            size = sum(block.size for block in self.blocks)
+            size += (len(self.timestamps) + len(self.ids)) * self.timestamps.itemsize
+            if self.numeric:
+                size += len(self.values) * self.values.itemsize
+            else:
+                size += sum(sys.getsizeof(value) for value in self.values)
+            return size
+
+    def first_seq(self):
+        "Sequence number of the first unacknowledged item. Expects the lock to be held."
+
+        if self.blocks:
+            return self.blocks_seq
+        return self.base_seq + self.head
+
+    def register(self, event, ts=None):
+        self.collect(event, None, ts=ts)
+
+    def collect(self, name, value, force_collection=False, ts=None):
         "Add an item to the store. Supports de-duping."
 
-        data = (int(time.time()), name, value)
+        if self.numeric:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                logger.warning("Skipping non-numeric value for %s: %r" % (name, value))
+                return
+
+        if ts is None:
+            ts = int(time.time())
         with self.lock:
             if self.de_dupe and not force_collection and self.last_state.get(name) == value:
                 logger.debug("Skipping metrics collection due to de-duping (%s=%s)" % (name,value))
                 return
 
+            # Keep the store in time order, even if the clock steps backwards
+            if self.timestamps and ts < self.timestamps[-1]:
+                ts = self.timestamps[-1]
+
             logger.info("Collecting %s: %s" % (name,value))
-            self.items.append(data)
+            self.append(ts, name, value)
             self.last_state[name] = value
+            self.seal()
+
+            if self.spool:
+                self.spool.append(self.base_seq + len(self.timestamps) - 1, (ts, name, value))
 
-    def get_completed(self, before):
-        "Get all items in this store that didn't occur in this second."
+                # Forget anything the spool had to drop to stay within its size cap
+                self.discard(self.spool.dropped_seq)
+
+    def append(self, ts, name, value):
+        "Append an item to the arrays. Expects the lock to be held."
+
+        name_id = self.name_ids.get(name)
+        if name_id is None:
+            name_id = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+
+        self.timestamps.append(ts)
+        self.ids.append(name_id)
+        self.values.append(value)
+
+        if self.rollups:
+            self.rollups.add(ts, name, value)
+
+    def seal(self):
+        "Compress the oldest items into blocks while a backlog is building. Expects the lock to be held."
+
+        while self.numeric and len(self.timestamps) - self.head >= 2 * self.SEAL_ITEMS:
+            start = self.head
+            end = start + self.SEAL_ITEMS
+            block = SealedBlock(self.base_seq + start, self.timestamps[start:end], self.ids[start:end], self.values[start:end])
+            if not self.blocks:
+                self.blocks_seq = block.first_seq
+            self.blocks.append(block)
+
+            del self.timestamps[:end]
+            del self.ids[:end]
+            del self.values[:end]
+            self.base_seq += end
+            self.head = 0
+
+    def decode_block(self, block):
+        "Decode a sealed block, caching the most recently decoded one. Expects the lock to be held."
+
+        if self.decoded_block is None or self.decoded_block[0] is not block:
+            self.decoded_block = (block, block.decode())
+        return self.decoded_block[1]
+
+    def get_completed(self, before=None, limit=None):
+        """
+        Get the oldest unacknowledged items in this store that occurred before
+        the given timestamp (or all of them if no timestamp is given), up to
+        an optional limit.
+
+        Returns the sequence number of the first item along with the items.
+        """
 
-        completed_items = []
         with self.lock:
-            this_second = int(time.time())
-            for item in self.items:
-                ts, name, value = item
-                if ts < before:
-                    completed_items.append(item)
+            first_seq = self.first_seq()
+            names = self.names
+            items = []
+
+            # Sealed blocks first, then the arrays, stopping at the limit or
+            # at the first item from on or after the cutoff
+            for block in self.blocks:
+                timestamps, ids, values = self.decode_block(block)
+                start = max(0, first_seq - block.first_seq)
+                end = self.completed_end(timestamps, start, before, limit, len(items))
+                items.extend((timestamps[i], names[ids[i]], values[i]) for i in xrange(start, end))
+                if end < block.count:
+                    return (first_seq, items)
 
-        return completed_items
+            start = self.head
+            end = self.completed_end(self.timestamps, start, before, limit, len(items))
+            items.extend(zip(
+                self.timestamps[start:end], [names[name_id] for name_id in self.ids[start:end]], self.values[start:end]
+            ))
+            return (first_seq, items)
+
+    def completed_end(self, timestamps, start, before, limit, count):
+        if before is None:
+            end = len(timestamps)
+        else:
+            end = bisect_left(timestamps, before, start)
+        if limit is not None:
+            end = min(end, start + limit - count)
+        return end
+
+    def acknowledge(self, seq):
+        "Discard all items with a sequence number lower than seq, as they have been sent."
 
-    def remove(self, items):
         with self.lock:
-            for item in items:
-                self.items.remove(item)
+            self.discard(seq)
+            if self.spool:
+                self.spool.acknowledge(seq)
+
+    def sync(self):
+        "Flush any buffered writes to the spool out to disk."
+
+        if self.spool:
+            with self.lock:
+                self.spool.sync()
+
+    def discard(self, seq):
+        "Drop all items with a sequence number lower than seq. Expects the lock to be held."
+
+        while self.blocks and self.blocks[0].end_seq <= seq:
+            self.blocks.pop(0)
+        if self.blocks:
+            self.blocks_seq = max(self.blocks_seq, seq)
+            return
+
+        head = min(seq - self.base_seq, len(self.timestamps))
+        if head <= self.head:
+            return
+        self.head = head
+
+        # Release the consumed items once they make up half the store
+        if self.head >= self.COMPACT_THRESHOLD and self.head * 2 >= len(self.timestamps):
+            del self.timestamps[:self.head]
+            del self.ids[:self.head]
+            del self.values[:self.head]
+            self.base_seq += self.head
+            self.head = 0
+
+            # Once the store is empty no ids are in use, so the names can be
+            # forgotten too, rather than growing with every series ever seen
+            if not self.timestamps:
+                del self.names[:]
+                self.name_ids.clear()
 
 class Collector:
     DEFAULT_METRICS_ENDPOINT = "http://notify.doppler.io/"
     DEFAULT_SEND_INTERVAL = 30
     SMALL_INTERVAL_DURATION = 30 * 60
+    MAX_CHUNK_ITEMS = 5000
+    DEFAULT_ROLLUP_AFTER = 10 * 60
+
+    metrics = {
+        "agent.flush_time": {
+            "title": "Flush Time",
+            "unit": "ms",
+            "aggregate": "max"
+        },
+        "agent.send_failures": {
+            "title": "Send Failures",
+            "unit": "Failures",
+            "aggregate": "last"
+        }
+    }
 
-    def __init__(self, api_key, machine_id, hostname, endpoint=None, send_interval=None):
+    def __init__(self, api_key, machine_id, hostname, endpoint=None, send_interval=None, spool_dir=None, spool_max_bytes=None, compress=True, rollup_window=None, rollup_after=None, wire_format=None, runtime=None, provider_config=None, providers=None, scheduler=None, transport=None):
         # Identifiers
         self.api_key = api_key
         self.machine_id = machine_id
@@ -67,151 +328,302 @@ class Collector:
         # Where to send to
         self.send_interval = send_interval or self.DEFAULT_SEND_INTERVAL
         self.endpoint = endpoint or self.DEFAULT_METRICS_ENDPOINT
+        self.compress = compress
+        self.transport = transport or HttpTransport(self.endpoint)
+        self.backoff = Backoff()
+        self.send_failures = 0
 
-        # List of active metrics providers
-        self._active_providers = None
+        # Whether the last failed send found the endpoint unavailable, as
+        # opposed to the payload itself being rejected: it couldn't be
+        # reached, was overloaded (429) or failed (5xx)
+        self.unavailable = False
 
-        # Thread-safe data structures for collecting metrics and metadata
-        self.metrics_store = ValueStore()
-        self.states_store = ValueStore(de_dupe=True)
-        self.events_store = ValueStore()
+        # List of active metrics providers (the current platform's, unless
+        # given), and the scheduler that runs them. In the evented runtime
+        # provider commands are run from a single reactor thread rather than
+        # blocking a worker each. The scheduler and transport may be shared
+        # with other collectors, when monitoring many targets.
+        self._active_providers = set(providers) if providers is not None else None
+        if scheduler is not None:
+            self.scheduler = scheduler
+        elif runtime == "evented":
+            self.scheduler = Scheduler(reactor=CommandReactor(), profiler=Profiler())
+        else:
+            self.scheduler = Scheduler(profiler=Profiler())
+        self.profiler = self.scheduler.profiler
+
+        # Settings for individual providers by name, and the running providers
+        self.provider_config = provider_config or {}
+        self.providers = {}
+
+        # Optionally, metrics older than rollup_after seconds are sent as
+        # aggregates over rollup_window seconds rather than raw samples
+        self.rollups = Rollups(rollup_window) if rollup_window else None
+        self.rollup_after = rollup_after or self.DEFAULT_ROLLUP_AFTER
+
+        # How each metric is aggregated in rollups, from the providers' metadata
+        self.aggregates = {}
+
+        # Thread-safe data structures for collecting metrics and metadata,
+        # optionally spooled to disk so they survive restarts
+        self.metrics_store = ValueStore(spool=self.create_spool(spool_dir, "metrics", spool_max_bytes), numeric=True, rollups=self.rollups)
+        self.states_store = ValueStore(de_dupe=True, spool=self.create_spool(spool_dir, "states", spool_max_bytes))
+        self.events_store = ValueStore(spool=self.create_spool(spool_dir, "events", spool_max_bytes))
         
-        # Set up the payload sections
-        self.metrics_payload = {}
-        self.states_payload = {}
-        self.events_payload = {}
+        # The payload that samples are sent in. Metrics can optionally be
+        # sent gorilla encoded rather than as JSON values.
+        self.payload = Payload(wire_format or "json")
         
         # Transmission lock, protecting against dual send
         self.transimission_lock = Lock()
-    
-        # TODO: Stores should be synced to disk, in case of agent shutdown or ctrl-c
-        # See: http://docs.python.org/2/library/shelve.html
+
+    def create_spool(self, spool_dir, name, max_bytes):
+        if spool_dir is None:
+            return None
+        return Spool(os.path.join(spool_dir, name), max_bytes=max_bytes)
     
     def active_providers(self):
         if self._active_providers is None:
-            provider_packages = [doppler.agent.providers.common]
-            if platform.system() == "Darwin":
-                provider_packages.append(doppler.agent.providers.mac)
-            elif platform.system() == "Linux":
-                provider_packages.append(doppler.agent.providers.linux)
-        
-            self._active_providers = set(get_providers_from_packages(provider_packages))
+            self._active_providers = set(get_providers_from_manifest(platform.system()))
         
         return self._active_providers
 
-    def deep_update_dict(self, destination, source):
-        for k,v in source.items():
-            if isinstance(v, dict):
-                if not k in destination or not isinstance(destination[k], dict):
-                    destination[k] = {}
-                self.deep_update_dict(destination[k], v)
-            else:
-                destination[k] = v
-        return destination
-
-    def add_ts_values(self, payload, values):
-        func = lambda: defaultdict(func)
-        generated = defaultdict(func)
-        for m in values:
-            ts, name, value = m
-            generated[name]["values"][ts] = value
-        returnValue = self.deep_update_dict(payload, generated)
-        return returnValue
-    
-    def add_ts_array(self, payload, values):
-        func = lambda: defaultdict(func)
-        generated = defaultdict(func)
-        for m in values:
-            ts, name, value = m
-            if "values" not in generated[name]["values"]:
-                generated[name]["values"] = [ts]
-            else:
-                generated[name]["values"].append(ts)
+    def start(self):
+        if not self.start_providers():
+            return
+        self.scheduler.start()
+
+        # Randomise when flushes happen, so agents started together don't all
+        # send in lockstep
+        time.sleep(random.uniform(0, self.pacing_interval()))
+        
+        # Start the collector's "post to server" loop
+        while True:
+            # Pace yourselves, backing off further while sends are failing
+            time.sleep(max(self.pacing_interval(), self.backoff.delay()))
             
-        return self.deep_update_dict(payload, generated)
+            if self.transmit_payload():
+                self.backoff.success()
+            else:
+                self.backoff.failure()
+
+    def start_providers(self):
+        "Schedule the enabled providers, returning False if there are none to run."
 
-    def start(self):
         if not self.active_providers():
             logger.warning("No metrics providers available")
-            return
+            return False
 
-        # Start all the provider threads
-        for provider_class in self.active_providers():
-            provider = provider_class(self, self.metrics_store, self.states_store, self.events_store)
-            provider.daemon = True
-            
-            if isinstance(provider.metrics, dict):
-                self.deep_update_dict(self.metrics_payload, provider.metrics)
-            if isinstance(provider.states, dict):
-                self.deep_update_dict(self.states_payload, provider.states)
-            if isinstance(provider.events, dict):
-                self.deep_update_dict(self.events_payload, provider.events)
-            
-            on_start = getattr(provider, "on_start", None)
-            if callable(on_start):
-                provider.on_start()
-            
-            provider.start()
-        
+        # Describe the agent's own flush, transmission and provider metrics
+        for metrics in (self.metrics, HttpTransport.metrics, PROVIDER_METRICS):
+            self.payload.metrics.describe(metrics)
+            for name, metadata in metrics.items():
+                self.aggregates[name] = metadata.get("aggregate")
+
+        # Schedule all the enabled providers
+        self.configure_providers(self.provider_config)
         self.start_time = int(time.time())
+        return True
+
+    def provider_enabled(self, provider_class, settings):
+        try:
+            enabled = coerce_setting(settings.get("enabled", "true"), True)
+        except ValueError as e:
+            logger.warning("Ignoring enabled setting for the %s provider (%s)" % (provider_class.__name__, e))
+            enabled = True
+        if not enabled:
+            logger.info("The %s provider is disabled" % provider_class.__name__)
+        return enabled
+
+    def start_provider(self, provider_class, settings):
+        provider = provider_class(self, self.metrics_store, self.states_store, self.events_store)
+        provider.configure(settings)
         
-        # Start the collector's "post to server" loop
-        while True:
-            # Pace yourselves
-            if self.start_time + self.SMALL_INTERVAL_DURATION > int(time.time()):
-                time.sleep(min(self.send_interval, 10))
+        if isinstance(provider.metrics, dict):
+            self.payload.metrics.describe(provider.metrics)
+            for name, metadata in provider.metrics.items():
+                self.aggregates[name] = metadata.get("aggregate")
+        if isinstance(provider.states, dict):
+            self.payload.states.describe(provider.states)
+        if isinstance(provider.events, dict):
+            self.payload.events.describe(provider.events)
+        
+        on_start = getattr(provider, "on_start", None)
+        if callable(on_start):
+            provider.on_start()
+        
+        self.providers[provider.name] = provider
+        self.scheduler.add(provider)
+
+    def configure_providers(self, provider_config):
+        """
+        Apply settings for the providers, by name: starting or stopping those
+        that have been enabled or disabled, and reconfiguring the rest in
+        place. Called again with the new settings when the config is reloaded.
+        """
+
+        self.provider_config = provider_config
+
+        known = set(provider_class.__name__ for provider_class in self.active_providers())
+        for name in set(provider_config) - known:
+            logger.warning("Ignoring settings for unknown provider %s" % name)
+
+        for provider_class in self.active_providers():
+            name = provider_class.__name__
+            settings = provider_config.get(name, {})
+            provider = self.providers.get(name)
+
+            if not self.provider_enabled(provider_class, settings):
+                if provider is not None:
+                    self.scheduler.remove(provider)
+                    del self.providers[name]
+            elif provider is None:
+                self.start_provider(provider_class, settings)
             else:
-                time.sleep(self.send_interval)
-            
-            self.transmit_payload()
+                interval = provider.interval
+                provider.configure(settings)
+
+                # Reschedule on the new interval, realigning its ticks
+                if provider.interval != interval:
+                    self.scheduler.remove(provider)
+                    self.scheduler.add(provider)
+
+    def pacing_interval(self):
+        if self.start_time + self.SMALL_INTERVAL_DURATION > int(time.time()):
+            return min(self.send_interval, 10)
+        return self.send_interval
 
     def transmit_payload(self, transmit_all = False):
         with self.transimission_lock:
-            time_collected = int(time.time())
-            if transmit_all:
-                # Collect all metrics, states and events
-                metrics = self.metrics_store.items
-                states = self.states_store.items
-                events = self.events_store.items
-            else:
-                # Collect all metrics, states and events collected in the past
-                metrics = self.metrics_store.get_completed(time_collected)
-                states = self.states_store.get_completed(time_collected)
-                events = self.events_store.get_completed(time_collected)
-            
-            self.add_ts_values(self.metrics_payload, metrics)
-            self.add_ts_values(self.states_payload, states)
-            self.add_ts_array(self.events_payload, events)
-
-            # Attempt to post the snapshots to our server
-            body = json.dumps({
-                "apiKey": self.api_key,
-                "machineId": self.machine_id,
-                "hostname": self.hostname,
-                "collectedTs": time_collected,
-                "sentTs": int(time.time()),
-                "metrics": self.metrics_payload,
-                "states": self.states_payload,
-                "events": self.events_payload
-            })
-
-            headers = {
-                "Content-Type": "application/json"
-            }
-            
-            request = urllib2.Request(self.endpoint, body, headers)
-            response = urllib2.urlopen(request)
-
-            # Check if POST was successful
-            if response.code == 200:
-                logger.info("Sent payload to %s (%s metrics, %s states, %s events)" % (self.endpoint, len(metrics), len(states), len(events)))
-
-                # Remove sent values from the stores
-                self.metrics_store.remove(metrics)
-                self.states_store.remove(states)
-                self.events_store.remove(events)
-                
-                # Clear the payloads
-                self.metrics_payload.clear()
-                self.states_payload.clear()
-                self.events_payload.clear()
\ No newline at end of file
+            start = time.time()
+            sent = self.transmit_backlog(transmit_all)
+            self.metrics_store.collect("agent.flush_time", round((time.time() - start) * 1000, 2))
+            if not sent:
+                self.send_failures += 1
+                self.metrics_store.collect("agent.send_failures", self.send_failures)
+            return sent
+
+    def transmit_backlog(self, transmit_all):
+        "Send everything collected so far in chunks. Expects the transmission lock to be held."
+
+        # Make sure nothing collected so far can be lost
+        self.metrics_store.sync()
+        self.states_store.sync()
+        self.events_store.sync()
+
+        time_collected = int(time.time())
+        if transmit_all:
+            # Collect all metrics, states and events
+            before = None
+        else:
+            # Collect all metrics, states and events collected in the past
+            before = time_collected
+
+        # Metrics from whole rollup windows older than this are rolled up
+        rollup_before = None
+        if self.rollups:
+            rollup_before = self.rollups.window_start(time_collected - self.rollup_after)
+
+        # Send the backlog in bounded chunks, each acknowledged as soon as
+        # it has been sent, so that catching up after an outage converges
+        while True:
+            limit = self.MAX_CHUNK_ITEMS
+            metrics_seq, metrics = self.metrics_store.get_completed(before, limit)
+            limit -= len(metrics)
+            states_seq, states = self.states_store.get_completed(before, limit)
+            limit -= len(states)
+            events_seq, events = self.events_store.get_completed(before, limit)
+            limit -= len(events)
+
+            if not self.transmit_chunk(time_collected, self.roll_up(metrics, rollup_before), states, events):
+                return False
+
+            # Remove sent values from the stores
+            self.metrics_store.acknowledge(metrics_seq + len(metrics))
+            self.states_store.acknowledge(states_seq + len(states))
+            self.events_store.acknowledge(events_seq + len(events))
+
+            # A chunk with room to spare means the backlog is empty
+            if limit > 0:
+                if self.rollups:
+                    self.rollups.discard(time_collected if before is None else before)
+                return True
+
+    def roll_up(self, metrics, before):
+        "Replace metrics from before the given timestamp with their rollups."
+
+        if not self.rollups or not metrics or metrics[0][0] >= before:
+            return metrics
+
+        rolled_up = []
+        windows = set()
+        for ts, name, value in metrics:
+            if ts >= before:
+                rolled_up.append((ts, name, value))
+                continue
+
+            start = self.rollups.window_start(ts)
+            if (name, start) in windows:
+                continue
+            windows.add((name, start))
+
+            # Multi metrics share the aggregate of their base metric
+            aggregate = self.aggregates.get(name.split(":", 1)[0])
+            rollup = self.rollups.value(name, start, aggregate)
+            rolled_up.append((start, name, value if rollup is None else rollup))
+
+        return rolled_up
+
+    def transmit_chunk(self, time_collected, metrics, states, events):
+        self.payload.clear()
+        self.payload.metrics.add(metrics)
+        self.payload.states.add(states)
+        self.payload.events.add(events)
+
+        header = {
+            "apiKey": self.api_key,
+            "machineId": self.machine_id,
+            "hostname": self.hostname,
+            "collectedTs": time_collected,
+            "sentTs": int(time.time())
+        }
+
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        # Stream the payload straight into the request, rather than building
+        # the whole body in memory first
+        if self.compress:
+            body = lambda: gzip_chunks(self.payload.iter_json(header))
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = lambda: self.payload.iter_json(header)
+        
+        # Attempt to post the snapshots to our server
+        import httplib
+        self.unavailable = False
+        try:
+            status, _ = self.transport.post(body, headers)
+        except (IOError, httplib.HTTPException) as e:
+            logger.warning("Failed to send payload to %s (%s)" % (self.endpoint, e))
+            self.unavailable = True
+            return False
+
+        # Report how long the connection and request took
+        if self.transport.connect_time is not None:
+            self.metrics_store.collect("agent.transport.connect_time", round(self.transport.connect_time, 2))
+        self.metrics_store.collect("agent.transport.request_time", round(self.transport.request_time, 2))
+        self.metrics_store.collect("agent.transport.bytes_sent", self.transport.bytes_sent)
+
+        # Check if POST was successful
+        if status != 200:
+            logger.warning("Failed to send payload to %s (status %s)" % (self.endpoint, status))
+            self.unavailable = status == 429 or status >= 500
+            return False
+
+        logger.info("Sent payload to %s (%s metrics, %s states, %s events, %s bytes)" % (self.endpoint, len(metrics), len(states), len(events), self.transport.bytes_sent))
+        
+        # Clear the payload
+        self.payload.sent()
+        return True
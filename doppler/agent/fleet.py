@@ -0,0 +1,176 @@
+import os
+import random
+import signal
+import sys
+import time
+import uuid
+
+from doppler.utils import logger
+from doppler.agent.collector import Collector
+from doppler.agent.providers import TARGET_PROVIDERS, load_provider
+from doppler.agent.scheduler import Scheduler
+from doppler.agent.profiling import Profiler
+from doppler.agent.transport import HttpTransport, Backoff
+
+class Fleet(object):
+    """
+    Monitors many remote targets, like redis instances or JSON stats
+    endpoints, from a single agent.
+
+    Each target gets a Collector of its own, so it has its own identity,
+    stores and spool, and is sent in its own payload. The targets' providers
+    all run on one shared scheduler with a bounded pool of workers, and the
+    payloads are all sent over one kept-alive connection.
+    """
+
+    DEFAULT_WORKERS = 16
+
+    def __init__(self, api_key, targets, endpoint=None, send_interval=None, spool_dir=None, spool_max_bytes=None, compress=True, wire_format=None, workers=None):
+        self.api_key = api_key
+        self.send_interval = send_interval or Collector.DEFAULT_SEND_INTERVAL
+        self.endpoint = endpoint or Collector.DEFAULT_METRICS_ENDPOINT
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.compress = compress
+        self.wire_format = wire_format
+        self.scheduler = Scheduler(workers=workers or self.DEFAULT_WORKERS, profiler=Profiler())
+        self.transport = HttpTransport(self.endpoint)
+        self.backoff = Backoff()
+        self.started = False
+
+        # Each target's collector by name, and the collectors in the order
+        # they are sent in
+        self.targets = {}
+        self.collectors = []
+        self.configure_targets(targets)
+
+    def target_provider(self, name, settings):
+        """
+        Work out a target's provider from its settings: its type, its address
+        and optionally the hostname it's reported as, with anything else
+        passed on to the provider. Returns the provider class, its settings
+        and the hostname, or None if the target can't be monitored.
+        """
+
+        settings = dict(settings)
+        target_type = settings.pop("type", None)
+        address = settings.pop("address", None)
+        hostname = settings.pop("hostname", name)
+
+        if target_type not in TARGET_PROVIDERS:
+            logger.warning("Ignoring target %s, its type must be one of %s" % (name, ", ".join(sorted(TARGET_PROVIDERS))))
+            return None
+        if not address:
+            logger.warning("Ignoring target %s, which has no address" % name)
+            return None
+
+        entry, address_setting = TARGET_PROVIDERS[target_type]
+        settings[address_setting] = address
+        return (load_provider(entry), settings, hostname)
+
+    def create_collector(self, name, provider_class, settings, hostname):
+        machine_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, hostname))
+        spool_dir = self.spool_dir
+        if spool_dir is not None:
+            spool_dir = os.path.join(spool_dir, "targets", name)
+
+        return Collector(
+            self.api_key, machine_id, hostname, self.endpoint, self.send_interval, spool_dir, self.spool_max_bytes,
+            self.compress, wire_format=self.wire_format, provider_config={provider_class.__name__: settings},
+            providers=[provider_class], scheduler=self.scheduler, transport=self.transport
+        )
+
+    def configure_targets(self, targets):
+        """
+        Apply the targets' settings: starting targets that have been added,
+        stopping those that have been removed, and reconfiguring the rest's
+        providers in place. A target whose type or hostname has changed is
+        started afresh, as it's now a different machine. Called again with
+        the new settings when the config is reloaded.
+        """
+
+        for name in set(self.targets) - set(targets):
+            self.stop_target(name)
+
+        for name, settings in sorted(targets.items()):
+            target = self.target_provider(name, settings)
+            collector = self.targets.get(name)
+            if target is None:
+                if collector is not None:
+                    self.stop_target(name)
+                continue
+
+            provider_class, provider_settings, hostname = target
+            if collector is not None and collector.hostname == hostname and collector.active_providers() == set([provider_class]):
+                if self.started:
+                    collector.configure_providers({provider_class.__name__: provider_settings})
+                else:
+                    collector.provider_config = {provider_class.__name__: provider_settings}
+                continue
+
+            if collector is not None:
+                self.stop_target(name)
+            collector = self.create_collector(name, provider_class, provider_settings, hostname)
+            if self.started and not collector.start_providers():
+                continue
+            self.targets[name] = collector
+
+        self.collectors = [self.targets[name] for name in sorted(self.targets)]
+
+    def stop_target(self, name):
+        "Stop monitoring a target. Anything it hasn't sent yet stays in its spool, if it has one."
+
+        collector = self.targets.pop(name)
+        for provider in collector.providers.values():
+            self.scheduler.remove(provider)
+        collector.providers.clear()
+        logger.info("Stopped monitoring target %s" % name)
+
+    def stopped_handler(self, signum, frame):
+        print "Detected agent stop"
+        self.transmit_payloads(True)
+        sys.exit(0)
+
+    def profiling_handler(self, signum, frame):
+        self.scheduler.profiler.toggle()
+
+    def start(self):
+        for name, collector in self.targets.items():
+            if not collector.start_providers():
+                del self.targets[name]
+        self.collectors = [self.targets[name] for name in sorted(self.targets)]
+        if not self.collectors:
+            logger.warning("No targets to monitor")
+            return
+        self.started = True
+        self.scheduler.start()
+
+        signal.signal(signal.SIGINT, self.stopped_handler)
+        signal.signal(signal.SIGTERM, self.stopped_handler)
+        signal.signal(signal.SIGUSR1, self.profiling_handler)
+
+        # Randomise when flushes happen, so agents started together don't all
+        # send in lockstep
+        time.sleep(random.uniform(0, self.send_interval))
+
+        while True:
+            time.sleep(max(self.send_interval, self.backoff.delay()))
+
+            if self.transmit_payloads():
+                self.backoff.success()
+            else:
+                self.backoff.failure()
+
+    def transmit_payloads(self, transmit_all=False):
+        """
+        Send each target's payload in turn. As they all go to the same
+        endpoint, sending stops as soon as it's unavailable (unreachable,
+        overloaded or failing), and False is returned so the whole fleet
+        backs off. A payload the endpoint rejects (any other 4xx) only holds
+        back its own target, which keeps its backlog for the next flush.
+        """
+
+        for collector in self.collectors:
+            if not collector.transmit_payload(transmit_all) and collector.unavailable:
+                return False
+        return True
@@ -0,0 +1,165 @@
+"""
+Compression for time series, after Facebook's Gorilla paper
+(http://www.vldb.org/pvldb/vol8/p1816-teller.pdf).
+
+Timestamps are stored as the difference between successive deltas, which
+is almost always zero for regularly sampled series, and values are stored
+XOR'd with the previous value, which needs very few bits for values that
+change slowly or not at all.
+"""
+
+import struct
+
+# Encodings of non-zero timestamp delta-of-deltas, smallest first, as
+# (prefix, prefix bits, value bits)
+DOD_ENCODINGS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b1111, 4, 64),
+)
+
+def float_to_bits(value):
+    return struct.unpack(">Q", struct.pack(">d", value))[0]
+
+def bits_to_float(bits):
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+def leading_zeros(bits):
+    return 64 - bits.bit_length()
+
+def trailing_zeros(bits):
+    return (bits & -bits).bit_length() - 1
+
+class BitWriter(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.pending = 0
+        self.pending_bits = 0
+
+    def write(self, value, bits):
+        self.pending = (self.pending << bits) | value
+        self.pending_bits += bits
+        while self.pending_bits >= 8:
+            self.pending_bits -= 8
+            self.data.append((self.pending >> self.pending_bits) & 0xff)
+        self.pending &= (1 << self.pending_bits) - 1
+
+    def getvalue(self):
+        if self.pending_bits:
+            return str(self.data + bytearray([self.pending << (8 - self.pending_bits)]))
+        return str(self.data)
+
+class BitReader(object):
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+        self.pending = 0
+        self.pending_bits = 0
+
+    def read(self, bits):
+        while self.pending_bits < bits:
+            self.pending = (self.pending << 8) | self.data[self.position]
+            self.position += 1
+            self.pending_bits += 8
+        self.pending_bits -= bits
+        value = self.pending >> self.pending_bits
+        self.pending &= (1 << self.pending_bits) - 1
+        return value
+
+def encode(timestamps, values):
+    "Encode parallel sequences of integer timestamps and float values."
+
+    writer = BitWriter()
+    count = len(timestamps)
+    writer.write(count, 32)
+    if not count:
+        return writer.getvalue()
+
+    previous_ts = timestamps[0]
+    previous_delta = 0
+    previous_bits = float_to_bits(values[0])
+    previous_leading = previous_trailing = None
+    writer.write(previous_ts & 0xffffffffffffffff, 64)
+    writer.write(previous_bits, 64)
+
+    for i in range(1, count):
+        ts = timestamps[i]
+        delta = ts - previous_ts
+        dod = delta - previous_delta
+        previous_ts, previous_delta = ts, delta
+
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for prefix, prefix_bits, value_bits in DOD_ENCODINGS:
+                limit = 1 << (value_bits - 1)
+                if -limit < dod <= limit:
+                    break
+            writer.write(prefix, prefix_bits)
+            writer.write(dod & ((1 << value_bits) - 1), value_bits)
+
+        bits = float_to_bits(values[i])
+        xor = bits ^ previous_bits
+        previous_bits = bits
+
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+
+        leading = min(leading_zeros(xor), 31)
+        trailing = trailing_zeros(xor)
+        if previous_leading is not None and leading >= previous_leading and trailing >= previous_trailing:
+            # The meaningful bits fit within the previous window
+            writer.write(0b10, 2)
+            writer.write(xor >> previous_trailing, 64 - previous_leading - previous_trailing)
+        else:
+            meaningful = 64 - leading - trailing
+            writer.write(0b11, 2)
+            writer.write(leading, 5)
+            writer.write(meaningful & 0x3f, 6)
+            writer.write(xor >> trailing, meaningful)
+            previous_leading, previous_trailing = leading, trailing
+
+    return writer.getvalue()
+
+def decode(data):
+    "Decode data produced by encode() back into lists of timestamps and values."
+
+    reader = BitReader(data)
+    count = reader.read(32)
+    if not count:
+        return ([], [])
+
+    ts = reader.read(64)
+    if ts >= 1 << 63:
+        ts -= 1 << 64
+    bits = reader.read(64)
+    timestamps = [ts]
+    values = [bits_to_float(bits)]
+
+    delta = 0
+    leading = trailing = 0
+    for i in range(1, count):
+        if reader.read(1):
+            # The number of leading ones in the prefix picks the encoding
+            ones = 1
+            while ones < len(DOD_ENCODINGS) and reader.read(1):
+                ones += 1
+            value_bits = DOD_ENCODINGS[ones - 1][2]
+            dod = reader.read(value_bits)
+            if dod > 1 << (value_bits - 1):
+                dod -= 1 << value_bits
+            delta += dod
+        ts += delta
+        timestamps.append(ts)
+
+        if reader.read(1):
+            if reader.read(1):
+                leading = reader.read(5)
+                meaningful = reader.read(6) or 64
+                trailing = 64 - leading - meaningful
+            bits ^= reader.read(64 - leading - trailing) << trailing
+        values.append(bits_to_float(bits))
+
+    return (timestamps, values)
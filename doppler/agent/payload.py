@@ -0,0 +1,115 @@
+import base64
+import json
+
+from doppler.agent import gorilla
+
+class PayloadSection(object):
+    """
+    One section (metrics, states or events) of a payload.
+
+    Samples are appended in place to a flat structure per series, and each
+    series' metadata is serialised to JSON once and cached. Metadata is
+    included until the first successful send.
+    """
+
+    def __init__(self, timestamps_only=False, wire_format="json"):
+        self.timestamps_only = timestamps_only
+        self.wire_format = wire_format
+        self.metadata = {}
+        self.metadata_json = {}
+        self.include_metadata = True
+        self.series = {}
+
+    def describe(self, metadata):
+        "Add metadata for the series in this section."
+
+        for name, fields in metadata.items():
+            self.metadata[name] = fields
+            self.metadata_json[name] = json.dumps(fields)[1:-1]
+        self.include_metadata = True
+
+    def add(self, items):
+        "Add (ts, name, value) samples to their series."
+
+        series = self.series
+        if self.timestamps_only:
+            for ts, name, value in items:
+                if name in series:
+                    series[name].append(ts)
+                else:
+                    series[name] = [ts]
+        else:
+            for ts, name, value in items:
+                if name in series:
+                    series[name][ts] = value
+                else:
+                    series[name] = {ts: value}
+
+    def clear(self):
+        self.series.clear()
+
+    def sent(self):
+        "Mark the current contents as sent, so metadata needn't be sent again."
+
+        self.series.clear()
+        self.include_metadata = False
+
+    def iter_json(self):
+        "Serialise the section as a series of JSON fragments."
+
+        names = set(self.series)
+        if self.include_metadata:
+            names.update(self.metadata)
+
+        yield "{"
+        for i, name in enumerate(names):
+            yield '%s%s:{' % ("," if i else "", json.dumps(name))
+            if self.include_metadata and self.metadata_json.get(name):
+                yield self.metadata_json[name]
+                if name in self.series:
+                    yield ","
+            if name in self.series:
+                yield self.values_json(self.series[name])
+            yield "}"
+        yield "}"
+
+    def values_json(self, values):
+        if self.wire_format == "gorilla" and not self.timestamps_only:
+            timestamps = sorted(values)
+            encoded = gorilla.encode(timestamps, [values[ts] for ts in timestamps])
+            return '"gorilla":"%s"' % base64.b64encode(encoded)
+        return '"values":' + json.dumps(values)
+
+    def to_json(self):
+        return "".join(self.iter_json())
+
+class Payload(object):
+    "A payload of metrics, states and events for sending to doppler."
+
+    def __init__(self, wire_format="json"):
+        self.metrics = PayloadSection(wire_format=wire_format)
+        self.states = PayloadSection()
+        self.events = PayloadSection(timestamps_only=True)
+        self.sections = (("metrics", self.metrics), ("states", self.states), ("events", self.events))
+
+    def clear(self):
+        for _, section in self.sections:
+            section.clear()
+
+    def sent(self):
+        for _, section in self.sections:
+            section.sent()
+
+    def iter_json(self, header):
+        "Serialise the payload as a series of JSON fragments, with the given header fields alongside the sections."
+
+        parts = ["%s:%s" % (json.dumps(key), json.dumps(value)) for key, value in header.items()]
+        yield "{" + ",".join(parts)
+        for key, section in self.sections:
+            yield ",%s:" % json.dumps(key)
+            for fragment in section.iter_json():
+                yield fragment
+        yield "}"
+
+    def to_json(self, header):
+        return "".join(self.iter_json(header))
@@ -0,0 +1,65 @@
+import cProfile
+import gc
+import os
+import pstats
+import tempfile
+import time
+from collections import Counter
+from threading import Lock
+
+from doppler.utils import logger
+
+class Profiler(object):
+    """
+    Optionally profiles provider runs, to see where the agent's own time goes.
+
+    cProfile only follows the thread that enables it, so each run is profiled
+    on its own and merged into the totals. Toggling profiling off writes the
+    totals to a .prof file for pstats, alongside a count of live objects by
+    type (tracemalloc isn't available on Python 2).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or tempfile.gettempdir()
+        self.enabled = False
+        self.stats = None
+        self.lock = Lock()
+
+    def toggle(self):
+        with self.lock:
+            if self.enabled:
+                self.enabled = False
+                self.dump()
+                self.stats = None
+            else:
+                logger.info("Profiling provider runs")
+                self.enabled = True
+
+    def call(self, func, *args):
+        if not self.enabled:
+            return func(*args)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            with self.lock:
+                if self.enabled:
+                    if self.stats is None:
+                        self.stats = pstats.Stats(profile)
+                    else:
+                        self.stats.add(profile)
+
+    def dump(self):
+        "Write out the profile so far. Expects the lock to be held."
+
+        path = os.path.join(self.directory, "doppler-agent-%d-%d" % (os.getpid(), time.time()))
+        if self.stats is not None:
+            self.stats.dump_stats(path + ".prof")
+
+        objects = Counter(type(obj).__name__ for obj in gc.get_objects())
+        with open(path + ".objects", "w") as f:
+            for name, count in objects.most_common(50):
+                f.write("%10d %s\n" % (count, name))
+
+        logger.info("Wrote profile to %s.prof and %s.objects" % (path, path))
@@ -1,18 +1,68 @@
-import inspect
+import distutils.spawn
+import io
+import os
 import pkgutil
+import select
+import signal
 import subprocess
-import time
-import threading
 import re
+import time
+from cStringIO import StringIO
+from threading import Lock
+
+from doppler.utils import logger
 
 DATA_UNIT_REGEX = r"^(\d+(?:\.\d+)?)([kmgtp]{1}(?:ib|b)?|b)?$"
+DATA_UNIT_RE = re.compile(DATA_UNIT_REGEX, re.IGNORECASE)
 DATA_UNIT_POWERS = ["b", "k", "m", "g", "t", "p"]
 
+# Metrics the agent reports about each provider's runs and commands
+PROVIDER_METRICS = {
+    "agent.provider.run_time": {
+        "title": "Run Time",
+        "unit": "ms",
+        "multi": True,
+        "aggregate": "max"
+    },
+    "agent.provider.cpu_time": {
+        "title": "CPU Time",
+        "unit": "ms",
+        "multi": True,
+        "aggregate": "max"
+    },
+    "agent.provider.parse_time": {
+        "title": "Parse Time",
+        "unit": "ms",
+        "multi": True,
+        "aggregate": "max"
+    },
+    "agent.provider.command_runs": {
+        "title": "Commands Run",
+        "unit": "Commands",
+        "multi": True,
+        "aggregate": "last"
+    },
+    "agent.provider.command_time": {
+        "title": "Command Time",
+        "unit": "ms",
+        "multi": True,
+        "aggregate": "max"
+    },
+    "agent.provider.command_timeouts": {
+        "title": "Command Timeouts",
+        "unit": "Timeouts",
+        "multi": True,
+        "aggregate": "last"
+    }
+}
+
 def get_modules_from_package(package):
     for loader, name, ispkg in pkgutil.iter_modules(package.__path__, package.__name__ + "."):
         yield __import__(name, fromlist="dummy")
 
 def get_providers_from_module(module):
+    # Only needed for discovery outside the manifest, so imported on demand
+    import inspect
     for name in dir(module):
         obj = getattr(module, name)
         if obj != Provider and inspect.isclass(obj) and issubclass(obj, Provider):
@@ -24,6 +74,67 @@ def get_providers_from_packages(packages):
             for provider in get_providers_from_module(module):
                 yield provider
 
+# The providers shipped with the agent, as "module:class", by platform.system()
+# (None for those that run everywhere), so that startup only imports the modules
+# for the current platform. Keep this in step with the provider modules.
+PROVIDER_MANIFEST = {
+    None: [
+        "doppler.agent.providers.common.agent:events",
+        "doppler.agent.providers.common.agent:agentStats",
+        "doppler.agent.providers.common.redis:redisInfo",
+    ],
+    "Linux": [
+        "doppler.agent.providers.linux.system:loadavg",
+        "doppler.agent.providers.linux.system:meminfo",
+        "doppler.agent.providers.linux.system:processes",
+        "doppler.agent.providers.linux.system:cpustat",
+        "doppler.agent.providers.linux.system:diskstats",
+        "doppler.agent.providers.linux.system:netdev",
+        "doppler.agent.providers.linux.system:filesystems",
+        "doppler.agent.providers.linux.system:cgroups",
+    ],
+    "Darwin": [
+        "doppler.agent.providers.mac.system:iostat",
+        "doppler.agent.providers.mac.system:top",
+        "doppler.agent.providers.mac.system:sysctl",
+    ],
+}
+
+# Providers for remote targets in multi-host mode, by the target's type,
+# along with the option the target's address is given to them in
+TARGET_PROVIDERS = {
+    "redis": ("doppler.agent.providers.common.redis:redisInfo", "instances"),
+    "http": ("doppler.agent.providers.common.http:httpStats", "url"),
+}
+
+def load_provider(entry):
+    "Import a provider given as \"module:class\"."
+
+    module_name, class_name = entry.split(":")
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)
+
+def get_providers_from_manifest(system, manifest=PROVIDER_MANIFEST):
+    for entry in manifest.get(None, []) + manifest.get(system, []):
+        try:
+            yield load_provider(entry)
+        except (ImportError, AttributeError) as e:
+            logger.warning("Provider %s could not be loaded: %s" % (entry, e))
+
+def coerce_setting(value, default):
+    "Convert a setting from the config file to the type of the default it overrides."
+
+    if isinstance(default, bool):
+        if value.lower() in ("1", "yes", "true", "on"):
+            return True
+        if value.lower() in ("0", "no", "false", "off"):
+            return False
+        raise ValueError("%r isn't a boolean" % value)
+    if isinstance(default, (int, long, float)):
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    return value
+
 def regex_list_index(l, regex):
     for i, key in enumerate(l):
         m = re.match(regex, key)
@@ -40,7 +151,7 @@ def value_for_regex_column(legend, data, regex):
 
 def convert_data_unit(size_string, output_unit="B", input_unit=None, round_down=True):
     if size_string and output_unit and len(output_unit) > 0:
-        match = re.match(DATA_UNIT_REGEX, size_string, re.IGNORECASE)
+        match = DATA_UNIT_RE.match(size_string)
         if match:
             val = float(match.group(1))
             if input_unit is None:
@@ -64,13 +175,158 @@ def convert_data_unit(size_string, output_unit="B", input_unit=None, round_down=
                 
                 return out
 
+class CommandTimeout(Exception):
+    pass
+
+def spawn_command(args):
+    "Start a command in its own process group, so it can be killed along with any children."
+
+    return subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, close_fds=True, preexec_fn=os.setsid)
+
+# Commands that have been killed but hadn't exited yet. Rather than waiting
+# on them, which could block for as long as one is stuck in the kernel,
+# they're polled with reap_killed_commands until they have
+killed_commands = set()
+killed_commands_lock = Lock()
+
+def kill_command(process):
+    "Kill a command's whole process group, leaving it to be reaped later if it hasn't exited yet."
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    with killed_commands_lock:
+        if process.poll() is None:
+            killed_commands.add(process)
+
+def reap_killed_commands():
+    "Reap the killed commands that have since exited, returning how many are still to go."
+
+    with killed_commands_lock:
+        for process in list(killed_commands):
+            if process.poll() is not None:
+                killed_commands.discard(process)
+        return len(killed_commands)
+
+def run_command(args, timeout):
+    """
+    Run a command and return its output, draining (and discarding) stderr as
+    it goes. If the command is still running after timeout seconds its
+    process group is killed and CommandTimeout is raised.
+    """
+
+    reap_killed_commands()
+
+    process = spawn_command(args)
+    deadline = time.time() + timeout
+    stdout_fd = process.stdout.fileno()
+    streams = {stdout_fd: process.stdout, process.stderr.fileno(): process.stderr}
+    output = []
+    try:
+        while streams:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                kill_command(process)
+                raise CommandTimeout("%s didn't finish within %ss" % (args[0], timeout))
+
+            readable, _, _ = select.select(list(streams), [], [], remaining)
+            for fd in readable:
+                data = os.read(fd, 64 * 1024)
+                if not data:
+                    streams.pop(fd).close()
+                elif fd == stdout_fd:
+                    output.append(data)
+
+        # The command may have closed its output without exiting
+        while process.poll() is None:
+            if time.time() >= deadline:
+                kill_command(process)
+                raise CommandTimeout("%s didn't exit within %ss" % (args[0], timeout))
+            time.sleep(0.01)
+    finally:
+        for stream in streams.values():
+            stream.close()
+
+        # Whatever went wrong, don't leave the command running
+        if process.poll() is None:
+            kill_command(process)
+
+    return "".join(output)
+
 def first_matching_line(iterator, regexp):
     return next(l for l in iterator if re.search(regexp, l))
 
 def get_lines(file):
     return file.read().strip().split("\n")
 
-class Provider(threading.Thread):
+class ProcFile(object):
+    """
+    A /proc (or /sys) file that is kept open and re-read from the start
+    each time, into a buffer that is reused between reads, rather than
+    being opened afresh for every sample.
+    """
+
+    BUFFER_SIZE = 16 * 1024
+
+    def __init__(self, path, buffer_size=None):
+        self.path = path
+        self.file = None
+        self.buffer = bytearray(buffer_size or self.BUFFER_SIZE)
+
+    def read(self):
+        "The file's current contents. Raises IOError if it can't be read, such as once a process has exited."
+
+        if self.file is None:
+            self.file = io.FileIO(self.path, "r")
+
+        try:
+            self.file.seek(0)
+
+            # seq_file backed files return about a page per read, so a
+            # short read isn't the end, only an empty one is. The buffer
+            # is grown whenever it fills up.
+            size = 0
+            while True:
+                if size == len(self.buffer):
+                    self.buffer.extend(bytearray(len(self.buffer)))
+                count = self.file.readinto(memoryview(self.buffer)[size:])
+                if not count:
+                    break
+                size += count
+        except (IOError, OSError):
+            self.close()
+            raise
+
+        return str(buffer(self.buffer, 0, size))
+
+    def lines(self):
+        return self.read().splitlines()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def parse_key_values(lines):
+    """
+    Parse "key: value [unit]" lines, like those in /proc/meminfo, into a dict
+    of integer values, ignoring any lines whose value isn't an integer.
+    """
+
+    values = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].isdigit():
+            values[fields[0].rstrip(":")] = int(fields[1])
+    return values
+
+def parse_columns(lines, min_columns=0):
+    "Split columnar lines, like those in /proc/diskstats, skipping any with too few columns."
+
+    return [columns for columns in (line.split() for line in lines) if len(columns) >= min_columns]
+
+class Provider(object):
     metrics = None
     events = None
     states = None
@@ -78,47 +334,173 @@ class Provider(threading.Thread):
     file = None
     interval = 5
 
+    # How long a command may run before it is killed, defaulting to the interval
+    timeout = None
+    DEFAULT_TIMEOUT = 30
+
+    # Attributes that aren't settings, though they look like options
+    RESERVED_ATTRIBUTES = ("metrics", "states", "events", "command", "file")
+
     def __init__(self, collector, metrics_store, states_store, events_store):
-        threading.Thread.__init__(self)
-        
         self.metrics_store = metrics_store
         self.states_store = states_store
         self.events_store = events_store
         
         self.collector = collector
 
+        # Timestamp of the scheduler tick currently being run
+        self.tick_ts = None
+
+        # Settings from the config file overriding the class's defaults
+        self.settings = {}
+
+        self._command_available = None
+        self.command_runs = 0
+        self.command_timeouts = 0
+
+        # How long parsing took in the current run, if there was anything to parse
+        self.parse_time = None
+
+        # The provider's file, kept open between runs
+        self.proc_file = None
+
         if self.metrics is None and self.events is None and self.states is None:
             raise Exception("Children must override one of metrics, events or states")
 
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def configure(self, settings):
+        """
+        Apply this provider's settings from the config file, replacing any
+        applied before. Any of the provider's options can be overridden,
+        along with its interval and timeout.
+        """
+
+        for key in self.settings:
+            del self.__dict__[key]
+        self.settings = {}
+
+        for key, value in settings.items():
+            if key == "enabled":
+                continue
+
+            # Only plain options can be set, not metadata, what the provider
+            # runs or reads, constants, properties or methods
+            default = getattr(self.__class__, key, None)
+            reserved = key.startswith("_") or key.isupper() or key in self.RESERVED_ATTRIBUTES
+            if not hasattr(self.__class__, key) or reserved or isinstance(default, property) or callable(default):
+                logger.warning("Ignoring unknown setting %s for the %s provider" % (key, self.name))
+                continue
+            if key == "interval" and default is None:
+                logger.warning("Ignoring interval for the %s provider, which only runs once" % self.name)
+                continue
+
+            # The timeout has no default of its own, but is always in seconds
+            if key == "timeout":
+                default = self.DEFAULT_TIMEOUT
+
+            try:
+                value = coerce_setting(value, default)
+                if key in ("interval", "timeout") and value <= 0:
+                    raise ValueError("it must be positive")
+            except ValueError as e:
+                logger.warning("Ignoring setting %s for the %s provider (%s)" % (key, self.name, e))
+                continue
+
+            setattr(self, key, value)
+            self.settings[key] = value
+
     def parser(self, output):
         raise Exception("Children must override parser method")
 
     def metric(self, name, value):
-        self.metrics_store.collect(name, value)
+        self.metrics_store.collect(name, value, ts=self.tick_ts)
 
     def state(self, name, value):
-        self.states_store.collect(name, value)
+        self.states_store.collect(name, value, ts=self.tick_ts)
     
     def event(self, name):
-        self.events_store.register(name)
+        self.events_store.register(name, ts=self.tick_ts)
+
+    def command_available(self):
+        "Whether this provider's command can be found on the path."
+
+        if self._command_available is None:
+            self._command_available = distutils.spawn.find_executable(self.command.split()[0]) is not None
+            if not self._command_available:
+                logger.warning("Couldn't find %s, the %s provider won't report" % (self.command.split()[0], self.name))
+        return self._command_available
+
+    def command_missing(self):
+        "Called instead of running the command when it isn't installed."
+
+        pass
+
+    def command_timeout(self):
+        return self.timeout or self.interval or self.DEFAULT_TIMEOUT
+
+    def record_command(self, duration, timed_out):
+        "Report how long this provider's command took, and how often it has timed out."
+
+        self.command_runs += 1
+        if timed_out:
+            self.command_timeouts += 1
+            logger.warning("%s provider's command was killed after %ss" % (self.name, self.command_timeout()))
+        self.metric("agent.provider.command_time:%s" % self.name, round(duration * 1000, 2))
+        self.metric("agent.provider.command_timeouts:%s" % self.name, self.command_timeouts)
+        self.metric("agent.provider.command_runs:%s" % self.name, self.command_runs)
+
+    def record_run(self, duration, cpu_time):
+        "Report how long a run of this provider took, and how much CPU time it used."
+
+        self.metric("agent.provider.run_time:%s" % self.name, round(duration * 1000, 2))
+        if cpu_time is not None:
+            self.metric("agent.provider.cpu_time:%s" % self.name, round(cpu_time * 1000, 2))
+        if self.parse_time is not None:
+            self.metric("agent.provider.parse_time:%s" % self.name, round(self.parse_time * 1000, 2))
+
+    def parse(self, data):
+        start = time.time()
+        self.parser(data)
+        self.parse_time = time.time() - start
+
+    def read_file(self):
+        "Read this provider's file as a list of lines, keeping it open for next time."
+
+        if self.proc_file is None or self.proc_file.path != self.file:
+            if self.proc_file is not None:
+                self.proc_file.close()
+            self.proc_file = ProcFile(self.file)
+        return self.proc_file.lines()
+
+    def parse_output(self, ts, output, duration):
+        "Parse the output of this provider's command, run elsewhere. The output is None if it timed out."
+
+        self.tick_ts = ts
+        self.parse_time = None
+        self.record_command(duration, output is None)
+        if output is not None:
+            self.parse(StringIO(output))
+
+    def tick(self, ts=None):
+        "Take a single sample. Called by the scheduler once per interval."
 
-    def run(self, continuous=True):
-        if self.interval is None:
-            self.begin()
+        self.tick_ts = ts
+        self.parse_time = None
+        if self.command and not self.command_available():
+            self.command_missing()
+        elif self.command:
+            start = time.time()
+            try:
+                output = run_command(self.command.split(), self.command_timeout())
+            except CommandTimeout:
+                self.record_command(time.time() - start, True)
+                return
+            self.record_command(time.time() - start, False)
+            self.parse(StringIO(output))
+        elif self.file:
+            self.parse(self.read_file())
         else:
-            while continuous:
-                if self.command:
-                    p = None
-                    try:
-                        p = subprocess.Popen(self.command.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                        self.parser(p.stdout)
-                    finally:
-                        if p:
-                            p.stdout.close()
-                elif self.file:
-                    with open(self.file) as f:
-                        self.parser(f)
-                else:
-                    self.fetch_value()
-
-                time.sleep(self.interval)
\ No newline at end of file
+            self.fetch_value()
@@ -1,4 +1,5 @@
 import signal
+from threading import Thread
 from doppler.agent.providers import Provider, value_for_column, value_for_regex_column, convert_data_unit, first_matching_line
 
 class events(Provider):
@@ -27,8 +28,49 @@ class events(Provider):
         signal.signal(signal.SIGINT, self.agent_stopped_handler)
         signal.signal(signal.SIGTERM, self.agent_stopped_handler)
         self.event("agent.started")
-        self.collector.transmit_payload(True)
         
     def begin(self):
-        # All events are logged in on_start
-        pass
\ No newline at end of file
+        # Runs once the scheduler has started. Send agent.started straight
+        # away, on a thread of its own so that a slow endpoint or a spooled
+        # backlog holds up neither collection nor the workers
+        sender = Thread(target=self.collector.transmit_payload, args=(True,), name="startup-send")
+        sender.daemon = True
+        sender.start()
+
+class agentStats(Provider):
+    """
+    Reports how much the agent is holding on to, and profiles the providers'
+    runs while toggled on with SIGUSR1
+    """
+
+    metrics = {
+        "agent.store.depth": {
+            "title": "Store Depth",
+            "unit": "Items",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "agent.store.size": {
+            "title": "Store Size",
+            "unit": "B",
+            "multi": True,
+            "aggregate": "max"
+        }
+    }
+    interval = 10
+
+    def profiling_handler(self, signum, frame):
+        self.collector.profiler.toggle()
+
+    def on_start(self):
+        signal.signal(signal.SIGUSR1, self.profiling_handler)
+
+    def fetch_value(self):
+        stores = {
+            "metrics": self.collector.metrics_store,
+            "states": self.collector.states_store,
+            "events": self.collector.events_store
+        }
+        for name, store in stores.items():
+            self.metric("agent.store.depth:%s" % name, len(store))
+            self.metric("agent.store.size:%s" % name, store.size())
@@ -0,0 +1,91 @@
+import httplib
+import json
+import socket
+from doppler.utils import logger
+from doppler.agent.providers import Provider
+from doppler.agent.transport import HttpTransport
+
+def flatten(data, prefix=""):
+    "Yield the numeric values in decoded JSON, keyed by their dotted paths."
+
+    if isinstance(data, dict):
+        items = data.iteritems()
+    elif isinstance(data, list):
+        items = enumerate(data)
+    else:
+        items = ()
+
+    for key, value in items:
+        path = "%s%s" % (prefix, key)
+        if isinstance(value, bool):
+            yield path, int(value)
+        elif isinstance(value, (int, long, float)):
+            yield path, value
+        else:
+            for item in flatten(value, path + "."):
+                yield item
+
+class httpStats(Provider):
+    """
+    Numeric values from a JSON stats endpoint, polled over a kept-alive connection
+    """
+
+    metrics = {
+        "service.http.up": {
+            "title": "Up",
+            "unit": "Up",
+            "aggregate": "min"
+        },
+        "service.http.response_time": {
+            "title": "Response Time",
+            "unit": "ms",
+            "aggregate": "max"
+        },
+        "service.http.value": {
+            "title": "Value",
+            "multi": True
+        }
+    }
+    interval = 10
+
+    # The endpoint to poll, and at most how many of its values to report
+    url = None
+    max_values = 500
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.transport = None
+
+    def configure(self, settings):
+        Provider.configure(self, settings)
+
+        # Reconnect in case the url or timeout have changed
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    def fetch_value(self):
+        if not self.url:
+            return
+        if self.transport is None:
+            self.transport = HttpTransport(self.url, self.command_timeout())
+
+        try:
+            status, body = self.transport.get({"Accept": "application/json"})
+            if status != 200:
+                raise IOError("status %s" % status)
+            data = json.loads(body)
+        except (IOError, ValueError, socket.error, httplib.HTTPException) as e:
+            logger.debug("Couldn't get stats from %s: %s" % (self.url, e))
+            self.transport.close()
+            self.metric("service.http.up", 0)
+            return
+
+        self.metric("service.http.up", 1)
+        self.metric("service.http.response_time", round(self.transport.request_time, 2))
+
+        for i, (key, value) in enumerate(flatten(data)):
+            if i >= self.max_values:
+                logger.warning("%s has more than %s values, only the first are reported" % (self.url, self.max_values))
+                break
+            self.metric("service.http.value:%s" % key, value)
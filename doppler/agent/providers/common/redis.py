@@ -1,11 +1,107 @@
-import distutils.spawn
-import re
-import subprocess
+import socket
+import time
+from doppler.utils import logger
 from doppler.agent.providers import Provider, value_for_column, value_for_regex_column, convert_data_unit, first_matching_line
 
+class RedisError(Exception):
+    pass
+
+class RedisConnection(object):
+    """
+    A persistent connection to a redis instance, over TCP ("host:port") or
+    a unix socket ("/path/to/redis.sock"), speaking RESP directly.
+    """
+
+    DEFAULT_PORT = 6379
+    TIMEOUT = 2
+
+    def __init__(self, address, password=None):
+        self.address = address
+        self.password = password
+        self.sock = None
+        self.reader = None
+
+    def connect(self):
+        if self.address.startswith("/"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.TIMEOUT)
+            sock.connect(self.address)
+        else:
+            host, _, port = self.address.rpartition(":")
+            sock = socket.create_connection((host or "localhost", int(port or self.DEFAULT_PORT)), self.TIMEOUT)
+
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+        if self.password:
+            self.command("AUTH", self.password)
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+            self.reader = None
+
+    def command(self, *args):
+        "Send a command, returning its reply. Reconnects if not connected."
+
+        if self.sock is None:
+            self.connect()
+
+        request = ["*%d\r\n" % len(args)]
+        for arg in args:
+            arg = str(arg)
+            request.append("$%d\r\n%s\r\n" % (len(arg), arg))
+
+        try:
+            self.sock.sendall("".join(request))
+            return self.read_reply()
+        except (socket.error, IOError):
+            self.close()
+            raise
+
+    def read_reply(self):
+        line = self.reader.readline()
+        if not line.endswith("\r\n"):
+            raise IOError("Connection to redis at %s closed" % self.address)
+
+        kind, data = line[0], line[1:-2]
+        if kind == "+":
+            return data
+        elif kind == "-":
+            raise RedisError(data)
+        elif kind == ":":
+            return int(data)
+        elif kind == "$":
+            length = int(data)
+            if length < 0:
+                return None
+            return self.reader.read(length + 2)[:-2]
+        elif kind == "*":
+            length = int(data)
+            if length < 0:
+                return None
+            return [self.read_reply() for i in range(length)]
+        raise IOError("Unexpected reply from redis at %s: %r" % (self.address, line))
+
+def parse_info(info):
+    "Parse the output of redis' INFO command into a dict."
+
+    fields = {}
+    for line in info.splitlines():
+        if line and not line.startswith("#"):
+            key, _, value = line.partition(":")
+            fields[key] = value
+    return fields
+
+def parse_info_dict(value):
+    "Parse a nested INFO value like keys=1,expires=0 into a dict."
+
+    return dict(item.partition("=")[::2] for item in value.split(","))
+
 class redisInfo(Provider):
     """
-    CPU related statistics sampled over a defined period
+    Redis server statistics, read over persistent connections
     """
  
     states = {
@@ -17,19 +113,124 @@ class redisInfo(Provider):
         "service.redis.used_memory": {
             "title": "Used Memory",
             "unit": "KiB"
+        },
+        "service.redis.instance_used_memory": {
+            "title": "Used Memory per Instance",
+            "unit": "KiB",
+            "multi": True
+        },
+        "service.redis.ops_per_sec": {
+            "title": "Operations",
+            "unit": "ops/s",
+            "multi": True
+        },
+        "service.redis.hit_ratio": {
+            "title": "Hit Ratio",
+            "unit": "%",
+            "multi": True
+        },
+        "service.redis.connected_clients": {
+            "title": "Connected Clients",
+            "unit": "Clients",
+            "multi": True
+        },
+        "service.redis.evictions": {
+            "title": "Evictions",
+            "unit": "keys/s",
+            "multi": True
+        },
+        "service.redis.keys": {
+            "title": "Keys",
+            "unit": "Keys",
+            "multi": True
+        },
+        "service.redis.replication_lag": {
+            "title": "Replication Lag",
+            "unit": "s",
+            "multi": True,
+            "aggregate": "max"
         }
     }
     interval = 10
 
+    # Comma separated list of instances to monitor, as host:port addresses
+    # or unix socket paths. The version and the unlabelled used memory
+    # reported are the first instance's.
+    instances = "localhost:6379"
+    password = None
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.connections = {}
+        self.previous = {}
+
+    def configure(self, settings):
+        Provider.configure(self, settings)
+
+        # Reconnect in case the instances or password have changed
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
     def fetch_value(self):
-        if distutils.spawn.find_executable("redis-cli"):
-            p = subprocess.Popen(("redis-cli", "info"), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            for line in p.stdout:
-                if line.startswith("redis_version:"):
-                    version = line.split(':')[1]
-                    self.state("system.packages.version.redis", version.strip())
-                elif line.startswith("used_memory:"):
-                    used_memory = line.split(':')[1]
-                    self.metric("service.redis.used_memory", convert_data_unit(used_memory.strip(), output_unit="KiB"))
+        addresses = [a.strip() for a in self.instances.split(",") if a.strip()]
+        for i, address in enumerate(addresses):
+            connection = self.connections.get(address)
+            if connection is None:
+                connection = self.connections[address] = RedisConnection(address, self.password)
+
+            try:
+                info = parse_info(connection.command("INFO"))
+            except (socket.error, IOError, RedisError) as e:
+                logger.debug("Couldn't get info from redis at %s: %s" % (address, e))
+                if i == 0:
+                    self.state("system.packages.version.redis", None)
+                continue
+
+            if i == 0:
+                self.state("system.packages.version.redis", info.get("redis_version"))
+                self.metric("service.redis.used_memory", convert_data_unit(info["used_memory"], output_unit="KiB"))
+            self.report(address, info)
+
+    def report(self, address, info):
+        self.metric("service.redis.instance_used_memory:%s" % address, convert_data_unit(info["used_memory"], output_unit="KiB"))
+        self.metric("service.redis.connected_clients:%s" % address, int(info["connected_clients"]))
+
+        # Key counts, per database and in total
+        total_keys = 0
+        for key, value in info.items():
+            if key.startswith("db") and key[2:].isdigit():
+                keys = int(parse_info_dict(value).get("keys", 0))
+                total_keys += keys
+                self.metric("service.redis.keys:%s/%s" % (address, key), keys)
+        self.metric("service.redis.keys:%s" % address, total_keys)
+
+        # Replication lag, as seen from a replica or the worst replica of a master
+        lag = None
+        if info.get("role") == "slave":
+            lag = int(info.get("master_last_io_seconds_ago", -1))
         else:
-            self.state("system.packages.version.redis", None)
\ No newline at end of file
+            lags = [int(parse_info_dict(value).get("lag", -1)) for key, value in info.items() if key.startswith("slave") and key[5:].isdigit()]
+            if lags:
+                lag = max(lags)
+        if lag is not None and lag >= 0:
+            self.metric("service.redis.replication_lag:%s" % address, lag)
+
+        # Rates, from the deltas of redis' counters
+        now = time.time()
+        counters = [int(info.get(name, 0)) for name in ("total_commands_processed", "keyspace_hits", "keyspace_misses", "evicted_keys")]
+        previous = self.previous.get(address)
+        self.previous[address] = (now, counters)
+        if previous is None:
+            return
+
+        elapsed = now - previous[0]
+        commands, hits, misses, evictions = [current - last for current, last in zip(counters, previous[1])]
+        if elapsed <= 0 or min(commands, hits, misses, evictions) < 0:
+            # Redis was restarted, so its counters were reset
+            return
+
+        self.metric("service.redis.ops_per_sec:%s" % address, round(commands / elapsed, 2))
+        self.metric("service.redis.evictions:%s" % address, round(evictions / elapsed, 2))
+        if hits + misses:
+            self.metric("service.redis.hit_ratio:%s" % address, round(100.0 * hits / (hits + misses), 2))
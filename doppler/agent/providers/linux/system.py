@@ -1,6 +1,10 @@
 import re
 import os
-from doppler.agent.providers import Provider, value_for_column, value_for_regex_column, convert_data_unit, first_matching_line
+import select
+import time
+from threading import Thread
+from doppler.utils import logger
+from doppler.agent.providers import Provider, ProcFile, value_for_column, value_for_regex_column, convert_data_unit, first_matching_line, parse_key_values, parse_columns
 
 class loadavg(Provider):
     """
@@ -58,24 +62,21 @@ class meminfo(Provider):
     }
     interval = 10
 
-    MEMINFO_RE = r"^(\w+):\s+([0-9]+)\s*(kB)?"
-
     def parser(self, io):
-        meminfo_metrics = {}
-        for line in io:
-            match = re.match(self.MEMINFO_RE, line)
-            if match:
-                metric, value, unit = match.groups()
-                meminfo_metrics[metric] = "%s%s" % (value, unit)
+        # Values are all in kB
+        meminfo_metrics = parse_key_values(io)
         
-        self.state("system.memory.total", convert_data_unit(meminfo_metrics["MemTotal"], output_unit="MiB"))
+        self.state("system.memory.total", convert_data_unit(str(meminfo_metrics["MemTotal"]), input_unit="kB", output_unit="MiB"))
     
-        self.metric("system.memory.free", convert_data_unit(meminfo_metrics["MemFree"], output_unit="MiB"))
-        self.metric("system.memory.active", convert_data_unit(meminfo_metrics["Active"], output_unit="MiB"))
-        self.metric("system.memory.inactive", convert_data_unit(meminfo_metrics["Inactive"], output_unit="MiB"))
+        self.metric("system.memory.free", convert_data_unit(str(meminfo_metrics["MemFree"]), input_unit="kB", output_unit="MiB"))
+        self.metric("system.memory.active", convert_data_unit(str(meminfo_metrics["Active"]), input_unit="kB", output_unit="MiB"))
+        self.metric("system.memory.inactive", convert_data_unit(str(meminfo_metrics["Inactive"]), input_unit="kB", output_unit="MiB"))
+
+class processes(Provider):
+    """
+    Top processes by CPU and memory usage, sampled from /proc
+    """
 
-class ps(Provider):
-    command = "ps aux"
     states = {
         "system.cpu.top_process": {
             "title": "Process with highest CPU usage",
@@ -85,37 +86,119 @@ class ps(Provider):
     metrics = {
         "system.cpu.top_process_usage": {
             "title": "CPU Usage",
-            "unit": "%"
+            "unit": "%",
+            "aggregate": "max"
+        },
+        "system.process.cpu": {
+            "title": "Process CPU Usage",
+            "unit": "%",
+            "multi": True
+        },
+        "system.process.memory": {
+            "title": "Process Memory",
+            "unit": "MiB",
+            "multi": True
         }
     }
     interval = 10
-    
-    def parser(self, io):
-        highest_cpu = None
-        process = None
-        for line in io:
+
+    # How many processes to report by CPU and by memory, with processes of
+    # the same name counted together
+    top_n = 5
+
+    PROC_PATH = "/proc"
+
+    # Stat files are kept open between samples, up to this many
+    MAX_OPEN_FILES = 256
+    STAT_BUFFER_SIZE = 1024
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.clock_ticks = float(os.sysconf("SC_CLK_TCK"))
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+
+        self.handles = {}
+        self.previous = {}
+        self.previous_time = None
+
+    def read_stat(self, pid):
+        stat = self.handles.get(pid)
+        if stat is not None:
             try:
-                elements = line.split()
-                cpu_usage = float(elements[2])
-                if highest_cpu == None or highest_cpu < cpu_usage:
-                    highest_cpu = cpu_usage
-                    if len(elements) == 11:
-                        process = elements[-1]
-                    else:
-                        process = " ".join(elements[10:-1])
-            except ValueError:
-                pass
-            
-        if process:
+                return stat.read()
+            except (IOError, OSError):
+                # The process has exited, and the pid may have been reused
+                del self.handles[pid]
+
+        stat = ProcFile(os.path.join(self.PROC_PATH, pid, "stat"), self.STAT_BUFFER_SIZE)
+        try:
+            data = stat.read()
+        except (IOError, OSError):
+            return None
+
+        if len(self.handles) < self.MAX_OPEN_FILES:
+            self.handles[pid] = stat
+        else:
+            stat.close()
+        return data
+
+    def fetch_value(self):
+        now = time.time()
+        elapsed = now - self.previous_time if self.previous_time else None
+        self.previous_time = now
+
+        pids = set(p for p in os.listdir(self.PROC_PATH) if p.isdigit())
+        for pid in set(self.handles) - pids:
+            self.handles.pop(pid).close()
+
+        # Usage is summed over processes of the same name, so that series
+        # are per program rather than per pid
+        usage = {}
+        current = {}
+        for pid in pids:
+            data = self.read_stat(pid)
+            if not data:
+                continue
+
+            # pid (comm) state ppid ... where comm may contain spaces and brackets
+            name_end = data.rfind(")")
+            name = data[data.find("(") + 1:name_end]
+            fields = data[name_end + 2:].split()
+
+            ticks = int(fields[11]) + int(fields[12])
+            start_time = int(fields[19])
+            rss = int(fields[21]) * self.page_size
+            current[pid] = (start_time, ticks)
+
+            cpu = 0.0
+            previous = self.previous.get(pid)
+            if elapsed and previous and previous[0] == start_time:
+                cpu = (ticks - previous[1]) / self.clock_ticks / elapsed * 100
+
+            total = usage.setdefault(name, [0.0, 0])
+            total[0] += cpu
+            total[1] += rss
+        self.previous = current
+
+        samples = [(cpu, rss, name) for name, (cpu, rss) in usage.items()]
+
+        if elapsed and samples:
+            by_cpu = sorted(samples, reverse=True)[:self.top_n]
+            cpu, rss, process = by_cpu[0]
             self.state("system.cpu.top_process", process)
-            self.metric("system.cpu.top_process_usage", highest_cpu)
+            self.metric("system.cpu.top_process_usage", round(cpu, 2))
+            for cpu, rss, process in by_cpu:
+                self.metric("system.process.cpu:%s" % process, round(cpu, 2))
+
+        for cpu, rss, process in sorted(samples, key=lambda s: s[1], reverse=True)[:self.top_n]:
+            self.metric("system.process.memory:%s" % process, round(convert_data_unit(str(rss), output_unit="MiB", round_down=False), 2))
 
-class mpstat(Provider):
+class cpustat(Provider):
     """
-    CPU related statistics sampled over a defined period
+    CPU related statistics sampled from the kernel's jiffy counters
     """
- 
-    command = "mpstat 1 3"
+
+    file = "/proc/stat"
     metrics = {
         "system.cpu.user": {
             "title": "User",
@@ -136,38 +219,86 @@ class mpstat(Provider):
         "system.cpu.io_wait": {
             "title": "IO Wait",
             "unit": "%"
+        },
+        "system.cpu.core.user": {
+            "title": "User per Core",
+            "unit": "%",
+            "multi": True
+        },
+        "system.cpu.core.used": {
+            "title": "Used per Core",
+            "unit": "%",
+            "multi": True
+        },
+        "system.cpu.core.system": {
+            "title": "System per Core",
+            "unit": "%",
+            "multi": True
+        },
+        "system.cpu.core.idle": {
+            "title": "Idle per Core",
+            "unit": "%",
+            "multi": True
+        },
+        "system.cpu.core.io_wait": {
+            "title": "IO Wait per Core",
+            "unit": "%",
+            "multi": True
         }
     }
     interval = 5
 
-    LEGEND_RE = r"(%usr|%user)"
-    DATA_RE = r"Average"
+    # Per-cpu values are reported as system.cpu.core.*:cpuN alongside the
+    # totals
+    per_core = True
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.previous = {}
 
     def parser(self, io):
-        lines = io.readlines()
+        for line in io:
+            if not line.startswith("cpu"):
+                continue
+
+            # cpu user nice system idle iowait irq softirq steal [guest guest_nice]
+            columns = line.split()
+            cpu = columns[0]
+            if cpu != "cpu" and not self.per_core:
+                continue
 
-        legend_line = first_matching_line(lines, self.LEGEND_RE)
-        data_line = first_matching_line(lines, self.DATA_RE)
+            # Guest time is already accounted for in user time
+            jiffies = [int(c) for c in columns[1:9]]
+            jiffies.extend([0] * (8 - len(jiffies)))
 
-        if legend_line and data_line:
-            if legend_line[1].lower() == "am" or legend_line[1].lower() == "pm":
-                legend = legend_line.split()[3:]
+            previous = self.previous.get(cpu)
+            self.previous[cpu] = jiffies
+            if previous is None:
+                continue
+
+            delta = [now - then for now, then in zip(jiffies, previous)]
+            total = float(sum(delta))
+            if total <= 0:
+                continue
+
+            user, nice, system, idle, iowait, irq, softirq, steal = delta
+            if cpu == "cpu":
+                prefix, suffix = "system.cpu.", ""
             else:
-                legend = legend_line.split()[2:]
-            data = data_line.split()[2:]
-            
-            self.metric("system.cpu.user", value_for_column(legend, data, "%usr"))
-            self.metric("system.cpu.system", value_for_column(legend, data, "%sys"))
-            self.metric("system.cpu.idle", value_for_column(legend, data, "%idle"))
-            self.metric("system.cpu.io_wait", value_for_column(legend, data, "%iowait"))
-            self.metric("system.cpu.used", "%.2f" % (100.0 - float(value_for_column(legend, data, "%idle"))))
+                prefix, suffix = "system.cpu.core.", ":%s" % cpu
+
+            self.metric(prefix + "user" + suffix, round(100 * (user + nice) / total, 2))
+            self.metric(prefix + "system" + suffix, round(100 * (system + irq + softirq) / total, 2))
+            self.metric(prefix + "idle" + suffix, round(100 * idle / total, 2))
+            self.metric(prefix + "io_wait" + suffix, round(100 * iowait / total, 2))
+            self.metric(prefix + "used" + suffix, round(100 * (total - idle) / total, 2))
 
-class iostat(Provider):
+class diskstats(Provider):
     """
-    Device I/O statistics sampled over a defined period
+    Device I/O statistics sampled from the kernel's disk counters
     """
-    
-    command = "iostat -d -x 1 3"
+
+    file = "/proc/diskstats"
     metrics = {
         "system.disk.read_throughput": {
             "title": "Read Throughput",
@@ -188,27 +319,758 @@ class iostat(Provider):
             "title": "Service Time",
             "unit": "ms",
             "multi": True
+        },
+        "system.disk.utilization": {
+            "title": "Utilization",
+            "unit": "%",
+            "multi": True
+        }
+    }
+    interval = 5
+
+    # Sectors in /proc/diskstats are always 512 bytes, whatever the device
+    SECTOR_SIZE = 512
+    SYS_BLOCK_PATH = "/sys/block"
+
+    # Device filtering. Devices matching include_devices are always reported,
+    # otherwise devices matching exclude_devices and (optionally) partitions
+    # are skipped.
+    include_devices = None
+    exclude_devices = r"^(loop|ram|dm-|sr|fd|zram)\d+$"
+    exclude_partitions = True
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.previous = {}
+        self.previous_time = None
+        self.device_names = None
+        self.whole_disks = None
+
+    def is_partition(self, device):
+        # Whole disks (and only whole disks) are listed in /sys/block, with
+        # any slashes in their names replaced by "!"
+        if self.whole_disks is None:
+            try:
+                self.whole_disks = set(d.replace("!", "/") for d in os.listdir(self.SYS_BLOCK_PATH))
+            except OSError:
+                self.whole_disks = set()
+        return bool(self.whole_disks) and device not in self.whole_disks
+
+    def is_reported(self, device):
+        if self.include_devices and re.match(self.include_devices, device):
+            return True
+        if self.exclude_devices and re.match(self.exclude_devices, device):
+            return False
+        if self.exclude_partitions and self.is_partition(device):
+            return False
+        return True
+
+    def parser(self, io):
+        now = time.time()
+        elapsed = now - self.previous_time if self.previous_time else None
+        self.previous_time = now
+
+        # major minor name reads reads_merged sectors_read read_ms
+        # writes writes_merged sectors_written write_ms in_flight io_ms weighted_ms
+        rows = parse_columns(io, 14)
+
+        # Re-read /sys/block whenever devices come or go
+        device_names = [columns[2] for columns in rows]
+        if device_names != self.device_names:
+            self.device_names = device_names
+            self.whole_disks = None
+
+        counters = {}
+        for columns in rows:
+            device = columns[2]
+            if not self.is_reported(device):
+                continue
+
+            reads, _, sectors_read, read_ms, writes, _, sectors_written, write_ms, _, io_ms = [int(c) for c in columns[3:13]]
+            counters[device] = (reads, sectors_read, read_ms, writes, sectors_written, write_ms, io_ms)
+
+        previous = self.previous
+        self.previous = counters
+        if not elapsed or elapsed <= 0:
+            return
+
+        for device, current in counters.items():
+            if device not in previous:
+                continue
+
+            reads, sectors_read, read_ms, writes, sectors_written, write_ms, io_ms = [
+                now_value - then_value for now_value, then_value in zip(current, previous[device])
+            ]
+
+            # Counters reset if a device is removed and re-added
+            if min(reads, sectors_read, read_ms, writes, sectors_written, write_ms, io_ms) < 0:
+                continue
+
+            ios = reads + writes
+            self.metric("system.disk.read_throughput:%s" % device, int(sectors_read * self.SECTOR_SIZE / elapsed))
+            self.metric("system.disk.write_throughput:%s" % device, int(sectors_written * self.SECTOR_SIZE / elapsed))
+            self.metric("system.disk.wait_time:%s" % device, round(float(read_ms + write_ms) / ios, 2) if ios else 0.0)
+            self.metric("system.disk.service_time:%s" % device, round(float(io_ms) / ios, 2) if ios else 0.0)
+            self.metric("system.disk.utilization:%s" % device, round(min(100.0, io_ms / (elapsed * 10)), 2))
+
+# Whether the kernel's counters are 64 bit, as they are on 64 bit kernels
+# other than for a few drivers
+KERNEL_64_BIT = "64" in os.uname()[4] or os.uname()[4] == "s390x"
+
+# How far a 32 bit counter can plausibly have moved between samples when it
+# seems to have wrapped on a 64 bit kernel
+WRAP_MARGIN = 2 ** 30
+
+def counter_delta(now, then, kernel_64_bit=KERNEL_64_BIT):
+    """
+    The increase in a kernel counter between two samples, allowing for 32 bit
+    counters wrapping around. Returns None if the counter was reset, such as
+    when an interface is recreated.
+    """
+
+    if now >= then:
+        return now - then
+    if then < 2 ** 32:
+        # 64 bit kernels only have 32 bit counters in a few drivers, so a
+        # drop is only a wrap if the counter was close to the limit
+        delta = now + 2 ** 32 - then
+        if not kernel_64_bit or delta < WRAP_MARGIN:
+            return delta
+    return None
+
+class netdev(Provider):
+    """
+    Network interface throughput and errors, plus TCP retransmits and connections
+    """
+
+    file = "/proc/net/dev"
+    metrics = {
+        "system.net.rx_bytes": {
+            "title": "Received",
+            "unit": "B/s",
+            "multi": True
+        },
+        "system.net.tx_bytes": {
+            "title": "Sent",
+            "unit": "B/s",
+            "multi": True
+        },
+        "system.net.rx_packets": {
+            "title": "Packets Received",
+            "unit": "packets/s",
+            "multi": True
+        },
+        "system.net.tx_packets": {
+            "title": "Packets Sent",
+            "unit": "packets/s",
+            "multi": True
+        },
+        "system.net.rx_errors": {
+            "title": "Receive Errors",
+            "unit": "packets/s",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.net.tx_errors": {
+            "title": "Send Errors",
+            "unit": "packets/s",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.net.rx_drops": {
+            "title": "Receive Drops",
+            "unit": "packets/s",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.net.tx_drops": {
+            "title": "Send Drops",
+            "unit": "packets/s",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.net.tcp.retransmits": {
+            "title": "TCP Retransmits",
+            "unit": "segments/s",
+            "aggregate": "max"
+        },
+        "system.net.tcp.retransmit_ratio": {
+            "title": "TCP Retransmit Ratio",
+            "unit": "%",
+            "aggregate": "max"
+        },
+        "system.net.tcp.established": {
+            "title": "TCP Connections",
+            "unit": "Connections"
         }
     }
     interval = 5
 
-    LEGEND_RE = r"Device:"
+    SNMP_PATH = "/proc/net/snmp"
+
+    # The /proc/net/dev columns reported for each interface, after its name
+    COLUMNS = [
+        ("rx_bytes", 0),
+        ("rx_packets", 1),
+        ("rx_errors", 2),
+        ("rx_drops", 3),
+        ("tx_bytes", 8),
+        ("tx_packets", 9),
+        ("tx_errors", 10),
+        ("tx_drops", 11)
+    ]
+
+    # Interface filtering. Interfaces matching include_interfaces are always
+    # reported, otherwise those matching exclude_interfaces are skipped, which
+    # by default are the per-container interfaces and bridges on container
+    # hosts.
+    include_interfaces = None
+    exclude_interfaces = r"^(veth|docker|br-)"
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.previous = {}
+        self.previous_tcp = None
+        self.previous_time = None
+        self.snmp = None
+
+    def is_reported(self, interface):
+        if self.include_interfaces and re.match(self.include_interfaces, interface):
+            return True
+        if self.exclude_interfaces and re.match(self.exclude_interfaces, interface):
+            return False
+        return True
 
     def parser(self, io):
-        output = io.read().strip()
+        now = time.time()
+        elapsed = now - self.previous_time if self.previous_time else None
+        self.previous_time = now
 
-        lines = output.split("\n\n")[-1].split("\n")
-        legend = first_matching_line(lines, self.LEGEND_RE).split()[1:]
-        
-        for device_line in lines[1:]:
-            columns = device_line.split()
-            device = columns[0]
-            data = columns[1:]
-
-            read_throughput, (read_unit,) = value_for_regex_column(legend, data, r"r([kM])B\/s")
-            write_throughput, (write_unit,) = value_for_regex_column(legend, data, r"w([kM])B\/s")
-
-            self.metric("system.disk.read_throughput:%s" % device, convert_data_unit(read_throughput, input_unit=read_unit))
-            self.metric("system.disk.write_throughput:%s" % device, convert_data_unit(write_throughput, input_unit=write_unit))
-            self.metric("system.disk.wait_time:%s" % device, value_for_column(legend, data, "await"))
-            self.metric("system.disk.service_time:%s" % device, value_for_column(legend, data, "svctm"))
\ No newline at end of file
+        # Two header lines, then "interface: rx columns... tx columns..."
+        counters = {}
+        for line in io:
+            interface, separator, columns = line.partition(":")
+            interface = interface.strip()
+            if not separator or "|" in columns or not self.is_reported(interface):
+                continue
+            columns = columns.split()
+            counters[interface] = [int(columns[i]) for _, i in self.COLUMNS]
+
+        previous = self.previous
+        self.previous = counters
+        if elapsed and elapsed > 0:
+            for interface, current in counters.items():
+                if interface not in previous:
+                    continue
+                deltas = [counter_delta(now_value, then_value) for now_value, then_value in zip(current, previous[interface])]
+
+                # Counters reset if an interface is removed and re-added
+                if None in deltas:
+                    continue
+
+                for (name, _), delta in zip(self.COLUMNS, deltas):
+                    self.metric("system.net.%s:%s" % (name, interface), round(delta / elapsed, 2))
+
+        self.report_tcp(elapsed)
+
+    def report_tcp(self, elapsed):
+        if self.snmp is None:
+            self.snmp = ProcFile(self.SNMP_PATH)
+        try:
+            tcp = self.parse_snmp(self.snmp.lines()).get("Tcp")
+        except (IOError, OSError):
+            return
+        if not tcp:
+            return
+
+        self.metric("system.net.tcp.established", int(tcp["CurrEstab"]))
+
+        current = (int(tcp["RetransSegs"]), int(tcp["OutSegs"]))
+        previous = self.previous_tcp
+        self.previous_tcp = current
+        if not elapsed or elapsed <= 0 or previous is None:
+            return
+
+        retransmits, sent = [counter_delta(now_value, then_value) for now_value, then_value in zip(current, previous)]
+        if retransmits is None or sent is None:
+            return
+        self.metric("system.net.tcp.retransmits", round(retransmits / elapsed, 2))
+        self.metric("system.net.tcp.retransmit_ratio", round(100.0 * retransmits / sent, 2) if sent else 0.0)
+
+    def parse_snmp(self, lines):
+        "Parse /proc/net/snmp's pairs of header and value lines into a dict per protocol."
+
+        protocols = {}
+        lines = parse_columns(lines)
+        for header, values in zip(lines[::2], lines[1::2]):
+            if header and values and header[0] == values[0]:
+                protocols[header[0].rstrip(":")] = dict(zip(header[1:], values[1:]))
+        return protocols
+
+def unescape_mount(path):
+    "Undo the octal escaping of spaces and other special characters in mount paths."
+
+    return re.sub(r"\\([0-7]{3})", lambda m: chr(int(m.group(1), 8)), path)
+
+class filesystems(Provider):
+    """
+    Space and inodes used on each mounted filesystem
+    """
+
+    metrics = {
+        "system.fs.used_bytes": {
+            "title": "Used Space",
+            "unit": "B",
+            "multi": True
+        },
+        "system.fs.free_bytes": {
+            "title": "Free Space",
+            "unit": "B",
+            "multi": True
+        },
+        "system.fs.used_percent": {
+            "title": "Space Used",
+            "unit": "%",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.fs.used_inodes": {
+            "title": "Used Inodes",
+            "unit": "Inodes",
+            "multi": True
+        },
+        "system.fs.free_inodes": {
+            "title": "Free Inodes",
+            "unit": "Inodes",
+            "multi": True
+        }
+    }
+    interval = 30
+
+    # mountinfo rather than mounts, as it tells bind mounts apart
+    MOUNTINFO_PATH = "/proc/self/mountinfo"
+
+    # Filesystems that don't hold data on a device, or are always full
+    PSEUDO_FILESYSTEMS = set([
+        "autofs", "binfmt_misc", "bpf", "cgroup", "cgroup2", "configfs", "debugfs", "devpts", "devtmpfs",
+        "efivarfs", "fusectl", "hugetlbfs", "mqueue", "nsfs", "proc", "pstore", "rpc_pipefs", "securityfs",
+        "selinuxfs", "squashfs", "sysfs", "tracefs", "overlay", "iso9660"
+    ])
+
+    # Filesystems backed by a local device or memory, which statvfs answers
+    # straight away. Any others, such as network and FUSE filesystems, can
+    # hang when their server or daemon goes away.
+    LOCAL_FILESYSTEMS = set([
+        "btrfs", "exfat", "ext2", "ext3", "ext4", "f2fs", "hfsplus", "jfs", "msdos", "nilfs2", "ntfs", "ntfs3",
+        "ramfs", "reiserfs", "tmpfs", "ubifs", "udf", "vfat", "xfs", "zfs"
+    ])
+
+    # Extra filtering: filesystem types (comma separated) and mountpoints
+    # (a regex) not to report
+    exclude_types = "tmpfs"
+    exclude_mountpoints = r"^/(proc|sys|dev)(/|$)"
+
+    # How long to wait for a non-local filesystem before skipping it, in seconds
+    mount_timeout = 2
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.mountinfo = None
+        self.poller = None
+        self.mounts = None
+        self.exclusions = None
+
+        # Threads still stuck in statvfs on unresponsive mounts
+        self.hung = {}
+
+    def read_mounts(self):
+        """
+        The mounts to report as (mountpoint, fstype) pairs, re-read only when
+        the kernel signals that the mount table has changed.
+        """
+
+        exclusions = (self.exclude_types, self.exclude_mountpoints)
+        if self.mountinfo is None:
+            self.mountinfo = ProcFile(self.MOUNTINFO_PATH)
+        elif self.mounts is not None and exclusions == self.exclusions and not self.poller.poll(0):
+            return self.mounts
+
+        lines = self.mountinfo.lines()
+        if self.poller is None:
+            self.poller = select.poll()
+            self.poller.register(self.mountinfo.file, select.POLLPRI | select.POLLERR)
+        self.mounts = self.parse_mountinfo(lines)
+        self.exclusions = exclusions
+        return self.mounts
+
+    def parse_mountinfo(self, io):
+        exclude_types = set(t.strip() for t in (self.exclude_types or "").split(",")) | self.PSEUDO_FILESYSTEMS
+
+        # id parent major:minor root mountpoint options [optional fields...] - fstype source super_options
+        mounts = {}
+        for index, line in enumerate(io):
+            columns = line.split()
+            if "-" not in columns:
+                continue
+            fstype = columns[columns.index("-") + 1]
+            device, root, mountpoint = columns[2], columns[3], unescape_mount(columns[4])
+
+            if fstype in exclude_types:
+                continue
+            if self.exclude_mountpoints and re.match(self.exclude_mountpoints, mountpoint):
+                continue
+
+            # Bind mounts show the same filesystem again, so only one mount
+            # of each device is reported: the one of its shallowest root,
+            # or the first of those. The root alone can't be relied on, as
+            # btrfs subvolumes such as /@ are normally mounted at /.
+            key = (root.rstrip("/").count("/"), index)
+            if device not in mounts or key < mounts[device][0]:
+                mounts[device] = (key, mountpoint, fstype)
+
+        return [(mountpoint, fstype) for _, mountpoint, fstype in sorted(mounts.values(), key=lambda mount: mount[0][1])]
+
+    def statvfs(self, mountpoint, results):
+        try:
+            results[mountpoint] = os.statvfs(mountpoint)
+        except OSError as e:
+            logger.debug("Couldn't stat %s: %s" % (mountpoint, e))
+
+    def statvfs_remote(self, mountpoints, results):
+        "statvfs non-local filesystems on their own threads, skipping any that don't answer in time."
+
+        threads = []
+        for mountpoint in mountpoints:
+            # A thread stuck on a mount can't be stopped, so don't start
+            # another one for it until it has come back
+            if mountpoint in self.hung:
+                if self.hung[mountpoint].is_alive():
+                    continue
+                del self.hung[mountpoint]
+
+            thread = Thread(target=self.statvfs, args=(mountpoint, results), name="statvfs")
+            thread.daemon = True
+            thread.start()
+            threads.append((mountpoint, thread))
+
+        deadline = time.time() + self.mount_timeout
+        for mountpoint, thread in threads:
+            thread.join(max(0, deadline - time.time()))
+            if thread.is_alive():
+                logger.warning("%s didn't respond within %ss, skipping it" % (mountpoint, self.mount_timeout))
+                self.hung[mountpoint] = thread
+
+    def fetch_value(self):
+        mounts = self.read_mounts()
+
+        # Local filesystems answer straight away, others might not
+        results = {}
+        for mountpoint, fstype in mounts:
+            if fstype in self.LOCAL_FILESYSTEMS:
+                self.statvfs(mountpoint, results)
+        remote = [mountpoint for mountpoint, fstype in mounts if fstype not in self.LOCAL_FILESYSTEMS]
+        if remote:
+            self.statvfs_remote(remote, results)
+
+        for mountpoint, _ in mounts:
+            stat = results.get(mountpoint)
+            if stat is None or not stat.f_blocks:
+                continue
+
+            # As df does, free space is what's available to unprivileged users
+            used = (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+            free = stat.f_bavail * stat.f_frsize
+            self.metric("system.fs.used_bytes:%s" % mountpoint, used)
+            self.metric("system.fs.free_bytes:%s" % mountpoint, free)
+            self.metric("system.fs.used_percent:%s" % mountpoint, round(100.0 * used / (used + free), 2) if used + free else 0.0)
+
+            # Some filesystems don't have a fixed number of inodes
+            if stat.f_files:
+                self.metric("system.fs.used_inodes:%s" % mountpoint, stat.f_files - stat.f_ffree)
+                self.metric("system.fs.free_inodes:%s" % mountpoint, stat.f_favail)
+
+def parse_flat_keyed(data):
+    "Parse a cgroup file of \"key value\" lines, like cpu.stat, into a dict of ints."
+
+    values = {}
+    for line in (data or "").splitlines():
+        fields = line.split()
+        if len(fields) == 2 and fields[1].isdigit():
+            values[fields[0]] = int(fields[1])
+    return values
+
+class cgroups(Provider):
+    """
+    CPU, memory and I/O used by each control group, such as containers and services
+    """
+
+    metrics = {
+        "system.cgroup.cpu_used": {
+            "title": "CPU Used",
+            "unit": "%",
+            "multi": True
+        },
+        "system.cgroup.cpu_throttled": {
+            "title": "CPU Throttled Periods",
+            "unit": "%",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.cgroup.throttled_time": {
+            "title": "CPU Throttled Time",
+            "unit": "ms/s",
+            "multi": True,
+            "aggregate": "max"
+        },
+        "system.cgroup.memory_used": {
+            "title": "Memory Used",
+            "unit": "MiB",
+            "multi": True
+        },
+        "system.cgroup.memory_limit": {
+            "title": "Memory Limit",
+            "unit": "MiB",
+            "multi": True
+        },
+        "system.cgroup.io_read": {
+            "title": "Read Throughput",
+            "unit": "B/s",
+            "multi": True
+        },
+        "system.cgroup.io_write": {
+            "title": "Write Throughput",
+            "unit": "B/s",
+            "multi": True
+        }
+    }
+    interval = 10
+
+    # Where the cgroup filesystems are mounted
+    root = "/sys/fs/cgroup"
+
+    # How deep to look for cgroups, where /docker/<id> is 2 deep, and how
+    # often to rescan the whole hierarchy (in seconds) rather than only
+    # the cgroups that already have children
+    max_depth = 4
+    rescan_interval = 60
+
+    # Cgroups not to report, as a regex of their paths
+    exclude_cgroups = None
+
+    # Memory limits at or above this mean there isn't one
+    UNLIMITED = 2 ** 60
+
+    # Control files are kept open between samples, up to this many
+    MAX_OPEN_FILES = 512
+    FILE_BUFFER_SIZE = 1024
+
+    def __init__(self, *args, **kwargs):
+        Provider.__init__(self, *args, **kwargs)
+        self.version = None
+        self.hierarchy = None
+
+        # The cgroups found so far, each with the paths of its children
+        self.children = {}
+        self.scanned_at = None
+
+        self.previous = {}
+        self.previous_time = None
+
+        # Open control files, by cgroup and then file
+        self.files = {}
+        self.open_files = 0
+
+    def detect(self):
+        # The unified (v2) hierarchy has cgroup.controllers at its root, while
+        # v1 has a hierarchy per controller, which should all have the same
+        # cgroups in them, so the cgroups are found in the memory hierarchy
+        if os.path.exists(os.path.join(self.root, "cgroup.controllers")):
+            self.version = 2
+            self.hierarchy = self.root
+        else:
+            self.version = 1
+            self.hierarchy = os.path.join(self.root, "memory")
+
+    def list_children(self, path):
+        directory = self.hierarchy + path
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return None
+        return [path.rstrip("/") + "/" + name for name in names if os.path.isdir(os.path.join(directory, name))]
+
+    def walk(self, path):
+        "Find a cgroup's descendants, down to max_depth."
+
+        if path != "/" and path.count("/") >= self.max_depth:
+            self.children[path] = []
+            return
+
+        children = self.list_children(path)
+        if children is None:
+            return
+        self.children[path] = children
+        for child in children:
+            self.walk(child)
+
+    def forget(self, path):
+        for child in self.children.pop(path, []):
+            self.forget(child)
+        self.previous.pop(path, None)
+        self.close_files(path)
+
+    def refresh(self, now):
+        """
+        Bring the known cgroups up to date. New cgroups almost always appear
+        under ones that already have children (like /docker, /kubepods or
+        /system.slice), so only those are re-listed each time, with the
+        whole hierarchy rescanned every rescan_interval seconds.
+        """
+
+        if self.scanned_at is None or now - self.scanned_at >= self.rescan_interval:
+            self.children = {}
+            self.walk("/")
+            self.scanned_at = now
+            for path in list(self.previous):
+                if path not in self.children:
+                    del self.previous[path]
+            for path in list(self.files):
+                if path not in self.children:
+                    self.close_files(path)
+            return
+
+        for path, children in self.children.items():
+            if not children and path != "/":
+                continue
+            current = self.list_children(path)
+            if current is None:
+                self.forget(path)
+                continue
+            known = set(children)
+            for child in set(children) - set(current):
+                self.forget(child)
+            for child in current:
+                if child not in known:
+                    self.walk(child)
+            self.children[path] = current
+
+    def read(self, controller, path, name):
+        "Read a cgroup's control file, returning None if it doesn't exist."
+
+        files = self.files.setdefault(path, {})
+        control_file = files.get(name)
+        if control_file is None:
+            if self.version == 2:
+                filename = self.root + path + "/" + name
+            else:
+                filename = os.path.join(self.root, controller) + path + "/" + name
+            control_file = ProcFile(filename, self.FILE_BUFFER_SIZE)
+
+        try:
+            data = control_file.read()
+        except (IOError, OSError):
+            if files.pop(name, None) is not None:
+                self.open_files -= 1
+            return None
+
+        if name not in files:
+            if self.open_files < self.MAX_OPEN_FILES:
+                files[name] = control_file
+                self.open_files += 1
+            else:
+                control_file.close()
+        return data
+
+    def close_files(self, path):
+        for control_file in self.files.pop(path, {}).values():
+            control_file.close()
+            self.open_files -= 1
+
+    def read_counters(self, path):
+        """
+        Read a cgroup's cumulative CPU time (ns), throttled periods and time (ns)
+        and bytes read and written, and its current memory use and limit.
+        """
+
+        counters = {}
+        if self.version == 2:
+            stat = parse_flat_keyed(self.read("cpu", path, "cpu.stat"))
+            if "usage_usec" in stat:
+                counters["cpu"] = stat["usage_usec"] * 1000
+            if "nr_periods" in stat:
+                counters["periods"] = stat["nr_periods"]
+                counters["throttled"] = stat["nr_throttled"]
+                counters["throttled_time"] = stat["throttled_usec"] * 1000
+            memory, limit = self.read("memory", path, "memory.current"), self.read("memory", path, "memory.max")
+
+            io = self.read("io", path, "io.stat")
+            if io is not None:
+                counters["read"] = counters["written"] = 0
+                for line in io.splitlines():
+                    fields = dict(field.split("=", 1) for field in line.split()[1:] if "=" in field)
+                    counters["read"] += int(fields.get("rbytes", 0))
+                    counters["written"] += int(fields.get("wbytes", 0))
+        else:
+            usage = self.read("cpuacct", path, "cpuacct.usage")
+            if usage is not None:
+                counters["cpu"] = int(usage)
+            stat = parse_flat_keyed(self.read("cpu", path, "cpu.stat"))
+            if "nr_periods" in stat:
+                counters["periods"] = stat["nr_periods"]
+                counters["throttled"] = stat["nr_throttled"]
+                counters["throttled_time"] = stat["throttled_time"]
+            memory, limit = self.read("memory", path, "memory.usage_in_bytes"), self.read("memory", path, "memory.limit_in_bytes")
+
+            io = self.read("blkio", path, "blkio.throttle.io_service_bytes")
+            if io is not None:
+                counters["read"] = counters["written"] = 0
+                for line in io.splitlines():
+                    fields = line.split()
+                    if len(fields) == 3 and fields[1] in ("Read", "Write"):
+                        counters["read" if fields[1] == "Read" else "written"] += int(fields[2])
+
+        if memory is not None:
+            counters["memory"] = int(memory)
+        if limit is not None and limit.strip() != "max" and int(limit) < self.UNLIMITED:
+            counters["limit"] = int(limit)
+        return counters
+
+    def fetch_value(self):
+        now = time.time()
+        elapsed = now - self.previous_time if self.previous_time else None
+        self.previous_time = now
+
+        if self.version is None:
+            self.detect()
+        self.refresh(now)
+
+        for path in self.children:
+            # The root cgroup is the whole machine, which the system providers cover
+            if path == "/" or (self.exclude_cgroups and re.match(self.exclude_cgroups, path)):
+                continue
+
+            counters = self.read_counters(path)
+            previous = self.previous.get(path)
+            self.previous[path] = counters
+
+            if "memory" in counters:
+                self.metric("system.cgroup.memory_used:%s" % path, round(counters["memory"] / 1048576.0, 2))
+            if "limit" in counters:
+                self.metric("system.cgroup.memory_limit:%s" % path, round(counters["limit"] / 1048576.0, 2))
+
+            if previous is None or not elapsed or elapsed <= 0:
+                continue
+            delta = dict((key, counters[key] - previous[key]) for key in counters if key in previous)
+
+            # Counters go backwards if a cgroup is removed and recreated
+            if any(value < 0 for key, value in delta.items() if key not in ("memory", "limit")):
+                continue
+
+            if "cpu" in delta:
+                self.metric("system.cgroup.cpu_used:%s" % path, round(100 * delta["cpu"] / (elapsed * 1e9), 2))
+            if "periods" in delta:
+                self.metric("system.cgroup.cpu_throttled:%s" % path, round(100.0 * delta["throttled"] / delta["periods"], 2) if delta["periods"] else 0.0)
+                self.metric("system.cgroup.throttled_time:%s" % path, round(delta["throttled_time"] / (elapsed * 1e6), 2))
+            if "read" in delta:
+                self.metric("system.cgroup.io_read:%s" % path, int(delta["read"] / elapsed))
+                self.metric("system.cgroup.io_write:%s" % path, int(delta["written"] / elapsed))
@@ -0,0 +1,152 @@
+import errno
+import fcntl
+import os
+import select
+import time
+from threading import Thread, Lock
+
+from doppler.utils import logger
+from doppler.agent.providers import spawn_command, kill_command, reap_killed_commands
+
+class RunningCommand(object):
+    def __init__(self, process, callback, timeout):
+        self.process = process
+        self.callback = callback
+        self.started = time.time()
+        self.deadline = self.started + timeout
+        self.streams = [process.stdout, process.stderr]
+        self.output = []
+
+class CommandReactor(Thread):
+    """
+    Runs provider commands without tying up a thread per command.
+
+    Commands are spawned with non-blocking pipes, and this single thread
+    waits on the output of all of them with select, killing any that overrun
+    their timeout. Once a command has closed its output and exited it is
+    reaped, and its stdout (or None if it timed out) is handed to a callback along with
+    how long it ran for. A command that overran is handed on straight away,
+    and reaped once it has exited after being killed.
+    """
+
+    READ_SIZE = 64 * 1024
+
+    # How often to check whether commands that have closed their output
+    # have exited, in seconds
+    REAP_INTERVAL = 0.01
+
+    # How often to check whether commands that have been killed have
+    # exited, in seconds
+    KILLED_REAP_INTERVAL = 0.5
+
+    def __init__(self):
+        Thread.__init__(self, name="reactor")
+        self.daemon = True
+
+        self.lock = Lock()
+        self.commands = set()
+        self.streams = {}
+
+        # Written to whenever a command is spawned, to wake up select
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        set_nonblocking(self.wakeup_read)
+
+    def spawn(self, args, callback, timeout):
+        "Start a command, calling callback with its output once it exits."
+
+        process = spawn_command(args)
+        command = RunningCommand(process, callback, timeout)
+        with self.lock:
+            self.commands.add(command)
+            for stream in command.streams:
+                set_nonblocking(stream.fileno())
+                self.streams[stream.fileno()] = (command, stream)
+        os.write(self.wakeup_write, "x")
+        return process
+
+    def run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                # Every command provider depends on this thread, so keep it
+                # going, rather than leaving their runs in progress forever
+                logger.exception("Command reactor failed")
+                time.sleep(self.REAP_INTERVAL)
+
+    def poll(self):
+        "Wait for and read the commands' output, then reap those that have exited or overrun."
+
+        with self.lock:
+            fds = list(self.streams)
+            commands = list(self.commands)
+
+        deadline = min([c.deadline for c in commands] or [None])
+        timeout = None if deadline is None else max(0, deadline - time.time())
+
+        # Commands that have closed their output are checked on until they
+        # exit, rather than waited on, so they don't hold up the others
+        if any(not c.streams for c in commands):
+            timeout = min(timeout, self.REAP_INTERVAL)
+
+        # Likewise killed commands, which are reaped once they've exited
+        if reap_killed_commands():
+            timeout = self.KILLED_REAP_INTERVAL if timeout is None else min(timeout, self.KILLED_REAP_INTERVAL)
+
+        try:
+            readable, _, _ = select.select(fds + [self.wakeup_read], [], [], timeout)
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+
+        for fd in readable:
+            if fd == self.wakeup_read:
+                try:
+                    os.read(fd, self.READ_SIZE)
+                except OSError:
+                    pass
+                continue
+
+            command, stream = self.streams[fd]
+            try:
+                data = os.read(fd, self.READ_SIZE)
+            except OSError:
+                continue
+
+            if data:
+                # Stderr is drained but discarded
+                if stream is command.process.stdout:
+                    command.output.append(data)
+                continue
+
+            self.close_stream(command, stream)
+
+        now = time.time()
+        for command in commands:
+            if not command.streams and command.process.poll() is not None:
+                self.finish(command)
+            elif command.deadline <= now:
+                kill_command(command.process)
+                for stream in list(command.streams):
+                    self.close_stream(command, stream)
+                self.finish(command, timed_out=True)
+
+    def close_stream(self, command, stream):
+        with self.lock:
+            del self.streams[stream.fileno()]
+        command.streams.remove(stream)
+        stream.close()
+
+    def finish(self, command, timed_out=False):
+        with self.lock:
+            self.commands.discard(command)
+
+        try:
+            command.callback(None if timed_out else "".join(command.output), time.time() - command.started)
+        except Exception:
+            logger.exception("Failed to handle command output")
+
+def set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
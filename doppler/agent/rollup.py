@@ -0,0 +1,66 @@
+from threading import Lock
+
+class Rollups(object):
+    """
+    Per-series aggregates over fixed time windows, updated incrementally as
+    samples are collected.
+
+    Each window keeps the min, max, sum, count and last value of the samples
+    that fell into it, from which any of the supported aggregates can be
+    read back.
+    """
+
+    AGGREGATES = ("min", "max", "avg", "sum", "count", "last")
+    DEFAULT_AGGREGATE = "avg"
+
+    def __init__(self, window):
+        self.window = window
+        self.lock = Lock()
+        self.windows = {}
+
+    def window_start(self, ts):
+        return ts - ts % self.window
+
+    def add(self, ts, name, value):
+        key = (name, self.window_start(ts))
+        with self.lock:
+            rollup = self.windows.get(key)
+            if rollup is None:
+                self.windows[key] = [value, value, value, 1, value]
+            else:
+                if value < rollup[0]:
+                    rollup[0] = value
+                if value > rollup[1]:
+                    rollup[1] = value
+                rollup[2] += value
+                rollup[3] += 1
+                rollup[4] = value
+
+    def value(self, name, start, aggregate=None):
+        "Get an aggregate of a series' window, or None if it has no samples."
+
+        with self.lock:
+            rollup = self.windows.get((name, start))
+        if rollup is None:
+            return None
+
+        minimum, maximum, total, count, last = rollup
+        aggregate = aggregate or self.DEFAULT_AGGREGATE
+        if aggregate == "min":
+            return minimum
+        elif aggregate == "max":
+            return maximum
+        elif aggregate == "sum":
+            return total
+        elif aggregate == "count":
+            return count
+        elif aggregate == "last":
+            return last
+        return total / count
+
+    def discard(self, before):
+        "Forget all windows that ended before the given timestamp."
+
+        with self.lock:
+            for key in [k for k in self.windows if k[1] + self.window <= before]:
+                del self.windows[key]
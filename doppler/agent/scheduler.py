@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import math
+import time
+from threading import Thread, Condition
+from Queue import Queue
+
+from doppler.utils import logger, thread_cpu_time
+
+class Scheduler(Thread):
+    """
+    Runs providers at a fixed rate on a bounded pool of worker threads.
+
+    Each provider's next run time is kept in a heap. Ticks are aligned to
+    multiples of the provider's interval and advance by exactly one interval
+    each time, so providers don't drift by their own run time, and providers
+    sharing an interval are handed the same timestamp for their samples.
+    """
+
+    DEFAULT_WORKERS = 4
+
+    def __init__(self, workers=None, reactor=None, profiler=None):
+        Thread.__init__(self, name="scheduler")
+        self.daemon = True
+
+        # When given a reactor, providers' commands are run on it and only
+        # their output is parsed on the worker pool
+        self.reactor = reactor
+
+        # Optionally profiles the providers' runs
+        self.profiler = profiler
+
+        self.condition = Condition()
+        self.schedule = []
+        self.order = itertools.count()
+        self.running = set()
+
+        self.tasks = Queue()
+        self.workers = []
+        for i in range(workers or self.DEFAULT_WORKERS):
+            worker = Thread(target=self.work, name="scheduler-worker-%d" % i)
+            worker.daemon = True
+            self.workers.append(worker)
+
+    def add(self, provider):
+        "Schedule a provider, starting at the next multiple of its interval."
+
+        if provider.interval is None:
+            # Providers without an interval only need to begin once
+            self.tasks.put((provider, None))
+            return
+
+        now = time.time()
+        due = math.ceil(now / provider.interval) * provider.interval
+        with self.condition:
+            heapq.heappush(self.schedule, (due, next(self.order), provider))
+            self.condition.notify()
+
+    def remove(self, provider):
+        "Stop scheduling a provider. A run already under way is left to finish."
+
+        with self.condition:
+            self.schedule = [entry for entry in self.schedule if entry[2] is not provider]
+            heapq.heapify(self.schedule)
+            self.condition.notify()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        if self.reactor:
+            self.reactor.start()
+        Thread.start(self)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.schedule:
+                    self.condition.wait()
+
+                due, _, provider = self.schedule[0]
+                now = time.time()
+                if due > now:
+                    self.condition.wait(due - now)
+                    continue
+
+                # Advance by whole intervals, skipping any ticks we've missed
+                interval = provider.interval
+                next_due = due + interval
+                if next_due <= now:
+                    next_due += math.floor((now - next_due) / interval + 1) * interval
+                heapq.heapreplace(self.schedule, (next_due, next(self.order), provider))
+
+                if provider in self.running:
+                    logger.warning("Skipping %s tick, previous run still in progress" % provider.name)
+                    continue
+                self.running.add(provider)
+
+            if self.reactor and provider.command and provider.command_available():
+                self.spawn(provider, int(due))
+            else:
+                self.tasks.put((provider, int(due)))
+
+    def spawn(self, provider, ts):
+        "Run a provider's command on the reactor, parsing its output on the pool."
+
+        def parse(output, duration):
+            self.tasks.put((provider, ts, output, duration))
+
+        try:
+            self.reactor.spawn(provider.command.split(), parse, provider.command_timeout())
+        except OSError:
+            logger.exception("Provider %s failed" % provider.name)
+            with self.condition:
+                self.running.discard(provider)
+
+    def run_provider(self, provider, ts, *output):
+        "Take a sample, or parse a command's output, timing how long it takes."
+
+        start = time.time()
+        cpu_start = thread_cpu_time()
+
+        run = provider.parse_output if output else provider.tick
+        if self.profiler:
+            self.profiler.call(run, ts, *output)
+        else:
+            run(ts, *output)
+
+        cpu_time = None if cpu_start is None else thread_cpu_time() - cpu_start
+        provider.record_run(time.time() - start, cpu_time)
+
+    def work(self):
+        while True:
+            task = self.tasks.get()
+            provider, ts = task[:2]
+            try:
+                if ts is None:
+                    provider.begin()
+                else:
+                    self.run_provider(provider, *task[1:])
+            except Exception:
+                logger.exception("Provider %s failed" % provider.name)
+            finally:
+                with self.condition:
+                    self.running.discard(provider)
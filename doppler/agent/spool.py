@@ -0,0 +1,239 @@
+import json
+import os
+import time
+
+from doppler.utils import logger
+
+class Spool(object):
+    """
+    Append-only, segment based on-disk log of the items in a ValueStore.
+
+    Items are written as JSON lines to segment files named after the sequence
+    number of their first item. Writes are buffered and only fsynced once
+    enough items or time have gone by. Acknowledged segments are deleted, and
+    once the spool grows past its size cap the oldest segments are dropped.
+
+    If writing fails, such as when the disk is full, spooling is suspended
+    and the items are only held in memory, until a write succeeds again.
+
+    A spool is owned by a single ValueStore, which serialises access to it.
+    """
+
+    SEGMENT_SUFFIX = ".seg"
+    ACK_FILENAME = "ack"
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    DEFAULT_SEGMENT_BYTES = 1024 * 1024
+    DEFAULT_SYNC_ITEMS = 1000
+    DEFAULT_SYNC_INTERVAL = 1.0
+
+    # How long spooling stays suspended after a write fails, in seconds
+    RETRY_INTERVAL = 60
+
+    def __init__(self, path, max_bytes=None, segment_bytes=None, sync_items=None, sync_interval=None):
+        self.path = path
+        self.max_bytes = max_bytes or self.DEFAULT_MAX_BYTES
+        self.segment_bytes = segment_bytes or self.DEFAULT_SEGMENT_BYTES
+        self.sync_items = sync_items or self.DEFAULT_SYNC_ITEMS
+        self.sync_interval = sync_interval or self.DEFAULT_SYNC_INTERVAL
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # Segments on disk, oldest first, as [first_seq, filename, size]
+        self.segments = []
+        for filename in os.listdir(self.path):
+            if filename.endswith(self.SEGMENT_SUFFIX):
+                first_seq = int(filename[:-len(self.SEGMENT_SUFFIX)])
+                size = os.path.getsize(os.path.join(self.path, filename))
+                self.segments.append([first_seq, filename, size])
+        self.segments.sort()
+
+        self.acked_seq = self.read_ack()
+        self.next_seq = self.acked_seq
+
+        # Items before this were dropped to keep within the size cap
+        self.dropped_seq = 0
+
+        # When writing last failed, while spooling is suspended
+        self.failed_at = None
+
+        # The segment currently being appended to
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def read_ack(self):
+        try:
+            with open(os.path.join(self.path, self.ACK_FILENAME)) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, ValueError):
+            return 0
+
+    def write_ack(self):
+        ack_path = os.path.join(self.path, self.ACK_FILENAME)
+        with open(ack_path + ".tmp", "w") as f:
+            f.write(str(self.acked_seq))
+        os.rename(ack_path + ".tmp", ack_path)
+
+    def replay(self):
+        """
+        Read back all unacknowledged items.
+
+        Returns the sequence number of the first item along with the items.
+        Sequence numbering for new items carries on from the last one read.
+        """
+
+        first_seq = None
+        items = []
+        for segment_seq, filename, size in self.segments:
+            with open(os.path.join(self.path, filename)) as f:
+                for line in f:
+                    try:
+                        seq, ts, name, value = json.loads(line)
+                    except ValueError:
+                        # A partially written line, left behind by a crash
+                        logger.warning("Ignoring truncated record in spool segment %s" % filename)
+                        break
+
+                    if seq < self.acked_seq:
+                        continue
+                    if first_seq is None:
+                        first_seq = seq
+                    items.append((ts, name, value))
+                    self.next_seq = seq + 1
+
+        if first_seq is None:
+            first_seq = self.next_seq
+
+        if items:
+            logger.info("Replayed %d items from %s" % (len(items), self.path))
+
+        return (first_seq, items)
+
+    def append(self, seq, item):
+        "Append an item, fsyncing once enough items or time have gone by."
+
+        # While spooling is suspended items are only held in memory
+        if self.failed_at is not None and time.time() - self.failed_at < self.RETRY_INTERVAL:
+            self.next_seq = seq + 1
+            return
+
+        try:
+            if self.failed_at is not None:
+                self.resume(seq)
+            if self.file is None or self.segments[-1][2] >= self.segment_bytes:
+                self.roll(seq)
+
+            ts, name, value = item
+            line = json.dumps([seq, ts, name, value], separators=(",", ":")) + "\n"
+            self.file.write(line)
+            self.segments[-1][2] += len(line)
+            self.next_seq = seq + 1
+
+            self.unsynced += 1
+            if self.unsynced >= self.sync_items or time.time() - self.last_sync >= self.sync_interval:
+                self.flush()
+        except (IOError, OSError) as e:
+            self.failed(e)
+            self.next_seq = seq + 1
+
+    def failed(self, error):
+        "Suspend spooling after a write has failed."
+
+        if self.failed_at is None:
+            logger.warning("Couldn't write to spool %s, only keeping items in memory for now: %s" % (self.path, error))
+        self.failed_at = time.time()
+        self.unsynced = 0
+
+        if self.file is not None:
+            try:
+                self.file.close()
+            except (IOError, OSError):
+                pass
+            self.file = None
+
+    def resume(self, seq):
+        """
+        Start spooling again from seq. Items from while spooling was
+        suspended never reached the disk, and replaying around that gap
+        would misnumber them, so anything older is given up on: it's still
+        held in memory until it's sent, but won't survive a restart.
+        """
+
+        logger.info("Resuming spooling to %s from item %d" % (self.path, seq))
+        self.failed_at = None
+        while self.segments:
+            self.remove_segment(self.segments.pop(0)[1])
+        self.acked_seq = max(self.acked_seq, seq)
+        self.write_ack()
+
+    def roll(self, seq):
+        "Close the current segment and start a new one at seq."
+
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+
+        filename = "%020d%s" % (seq, self.SEGMENT_SUFFIX)
+        self.file = open(os.path.join(self.path, filename), "a")
+        self.segments.append([seq, filename, 0])
+        self.enforce_size_cap()
+
+    def enforce_size_cap(self):
+        "Drop the oldest segments until the spool fits within max_bytes."
+
+        total = sum(size for _, _, size in self.segments)
+        while total > self.max_bytes and len(self.segments) > 1:
+            first_seq, filename, size = self.segments.pop(0)
+            self.remove_segment(filename)
+            total -= size
+            self.dropped_seq = self.segments[0][0]
+            logger.warning("Spool %s is over %d bytes, dropped items %d to %d" % (self.path, self.max_bytes, first_seq, self.segments[0][0] - 1))
+
+    def sync(self):
+        try:
+            self.flush()
+        except (IOError, OSError) as e:
+            self.failed(e)
+
+    def flush(self):
+        "Write out and fsync any buffered items, raising if that fails."
+
+        if self.file is not None and self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def acknowledge(self, seq):
+        "Mark all items before seq as sent, deleting segments that only hold sent items."
+
+        if seq <= self.acked_seq:
+            return
+        self.acked_seq = seq
+
+        # A segment is fully sent once the next segment starts at or before seq
+        while len(self.segments) > 1 and self.segments[1][0] <= seq:
+            self.remove_segment(self.segments.pop(0)[1])
+
+        if seq >= self.next_seq and self.segments:
+            # Everything has been sent, start afresh with the next item
+            if self.file is not None:
+                try:
+                    self.file.close()
+                except (IOError, OSError) as e:
+                    self.failed(e)
+                self.file = None
+            self.remove_segment(self.segments.pop()[1])
+
+        try:
+            self.write_ack()
+        except (IOError, OSError) as e:
+            self.failed(e)
+
+    def remove_segment(self, filename):
+        try:
+            os.remove(os.path.join(self.path, filename))
+        except OSError as e:
+            logger.warning("Couldn't remove spool segment %s: %s" % (filename, e))
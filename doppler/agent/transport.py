@@ -0,0 +1,190 @@
+import random
+import socket
+import time
+import urlparse
+
+from doppler.utils import logger, buffer_chunks
+
+class HttpTransport(object):
+    """
+    Posts payloads to an HTTP(S) endpoint over a persistent keep-alive
+    connection, reconnecting whenever the connection fails or is closed.
+    """
+
+    DEFAULT_TIMEOUT = 30
+
+    metrics = {
+        "agent.transport.connect_time": {
+            "title": "Connect Time",
+            "unit": "ms",
+            "aggregate": "max"
+        },
+        "agent.transport.request_time": {
+            "title": "Request Time",
+            "unit": "ms",
+            "aggregate": "max"
+        },
+        "agent.transport.bytes_sent": {
+            "title": "Payload Size",
+            "unit": "B",
+            "aggregate": "sum"
+        }
+    }
+
+    def __init__(self, endpoint, timeout=None):
+        url = urlparse.urlsplit(endpoint)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path or "/"
+        if url.query:
+            self.path += "?" + url.query
+
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.connection = None
+
+        # Timings of the most recent post, in milliseconds. The connect time
+        # is None when an existing connection was reused.
+        self.connect_time = None
+        self.request_time = None
+
+        # Size of the most recently sent body, in bytes
+        self.bytes_sent = None
+
+    def connect(self):
+        # httplib (and ssl with it) is a good share of the agent's import
+        # time, so it's only loaded once there's something to send
+        import httplib
+
+        if self.scheme == "https":
+            connection = httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+        start = time.time()
+        connection.connect()
+        self.connect_time = (time.time() - start) * 1000
+
+        # Requests are written in several pieces (headers, then chunks), so
+        # don't let Nagle's algorithm hold them back on a kept-alive
+        # connection waiting for the server's delayed ACKs
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection = connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def post(self, body, headers):
+        """
+        POST a body to the endpoint, returning the response status and body.
+
+        The body is either a string, or a function returning an iterable of
+        strings, which is streamed using chunked transfer encoding. The
+        function may be called more than once if the post is retried.
+        """
+
+        return self.request("POST", body, headers)
+
+    def get(self, headers=None):
+        "GET the endpoint, returning the response status and body."
+
+        return self.request("GET", None, headers or {})
+
+    def request(self, method, body, headers):
+        import httplib
+
+        self.connect_time = None
+        while True:
+            reused = self.connection is not None
+            if not reused:
+                self.connect()
+
+            try:
+                start = time.time()
+                if callable(body):
+                    self.send_chunked(body(), headers)
+                else:
+                    self.connection.request(method, self.path, body, headers)
+                    self.bytes_sent = len(body or "")
+                response = self.connection.getresponse()
+                data = response.read()
+                self.request_time = (time.time() - start) * 1000
+            except (httplib.HTTPException, socket.error) as e:
+                self.close()
+
+                # The server may have dropped an idle connection, so retry
+                # once on a fresh one before giving up
+                if not reused:
+                    raise
+                logger.debug("Kept-alive connection to %s failed (%s), reconnecting" % (self.host, e))
+                continue
+
+            if response.will_close:
+                self.close()
+            return (response.status, data)
+
+    def send_chunked(self, chunks, headers):
+        self.connection.putrequest("POST", self.path, skip_accept_encoding=True)
+        for header, value in headers.items():
+            self.connection.putheader(header, value)
+        self.connection.putheader("Transfer-Encoding", "chunked")
+        self.connection.endheaders()
+
+        self.bytes_sent = 0
+        for chunk in buffer_chunks(chunks):
+            self.connection.send("%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.bytes_sent += len(chunk)
+        self.connection.send("0\r\n\r\n")
+
+class Backoff(object):
+    """
+    Exponential backoff with full jitter for failed sends, plus a circuit
+    breaker.
+
+    After each consecutive failure the next send waits a random time of up
+    to base * 2^failures seconds (capped). Once `threshold` sends in a row
+    have failed the circuit opens and sends pause for around `cooldown`
+    seconds, after which a single trial send is let through.
+    """
+
+    DEFAULT_BASE = 5
+    DEFAULT_CAP = 300
+    DEFAULT_THRESHOLD = 5
+    DEFAULT_COOLDOWN = 600
+
+    def __init__(self, base=None, cap=None, threshold=None, cooldown=None):
+        self.base = base or self.DEFAULT_BASE
+        self.cap = cap or self.DEFAULT_CAP
+        self.threshold = threshold or self.DEFAULT_THRESHOLD
+        self.cooldown = cooldown or self.DEFAULT_COOLDOWN
+
+        self.failures = 0
+        self.next_attempt = 0
+
+    @property
+    def is_open(self):
+        return self.failures >= self.threshold
+
+    def delay(self):
+        "Seconds until the next send may be attempted."
+
+        return max(0, self.next_attempt - time.time())
+
+    def success(self):
+        if self.is_open:
+            logger.info("Sending succeeded again, closing circuit")
+        self.failures = 0
+        self.next_attempt = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.is_open:
+            # Spread the cooldowns out, so agents don't all retry at once
+            delay = random.uniform(self.cooldown / 2.0, self.cooldown)
+            logger.warning("%d sends failed in a row, pausing sends for %d seconds" % (self.failures, delay))
+        else:
+            delay = random.uniform(0, min(self.cap, self.base * 2 ** self.failures))
+            logger.info("Send failed, backing off for %d seconds" % delay)
+        self.next_attempt = time.time() + delay
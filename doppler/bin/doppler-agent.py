@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os
+import signal
 import socket
 import doppler
 import uuid
@@ -9,11 +10,13 @@ import ConfigParser
 import sys
 import bugsnag
 import urllib
+import threading
 
 from optparse import OptionParser
 
 from doppler import __version__ as version
 from doppler.agent.collector import Collector
+from doppler.agent.fleet import Fleet
 from doppler.utils import trim_docstring
 
 
@@ -52,6 +55,12 @@ parser.add_option(
     type="int",
     help="how often metrics are sent to doppler"
 )
+parser.add_option(
+    "-r", "--runtime",
+    dest="runtime",
+    choices=["threaded", "evented"],
+    help="how providers are run, either threaded (the default) or evented"
+)
 (options, args) = parser.parse_args()
 
 # Pull out command line arg values
@@ -59,6 +68,7 @@ config_filename = options.config_filename
 api_key = options.api_key
 endpoint = options.endpoint
 send_interval = options.send_interval
+runtime = options.runtime
 
 # Load the config file
 config = ConfigParser.RawConfigParser()
@@ -86,25 +96,148 @@ if send_interval is None:
     # Do nothing here, we revert to default
     pass
 
+# Where to spool unsent data on disk, if anywhere
+spool_dir = None
+spool_max_bytes = None
+try:
+  spool_dir = config.get("doppler-agent", "spool_dir")
+  spool_max_bytes = config.getint("doppler-agent", "spool_max_size") * 1024 * 1024
+except ConfigParser.Error:
+  # Do nothing here, we revert to default
+  pass
+
+# Whether to gzip payloads
+compress = True
+try:
+  compress = config.getboolean("doppler-agent", "compress")
+except ConfigParser.Error:
+  # Do nothing here, we revert to default
+  pass
+
+# Whether to roll up older metrics, and over what window
+rollup_window = None
+rollup_after = None
+try:
+  rollup_window = config.getint("doppler-agent", "rollup_window")
+  rollup_after = config.getint("doppler-agent", "rollup_after")
+except ConfigParser.Error:
+  # Do nothing here, we revert to default
+  pass
+
+# How to encode metric values on the wire
+wire_format = None
+try:
+  wire_format = config.get("doppler-agent", "wire_format")
+except ConfigParser.Error:
+  # Do nothing here, we revert to default
+  pass
+
+if runtime is None:
+  try:
+    runtime = config.get("doppler-agent", "runtime")
+  except ConfigParser.Error:
+    # Do nothing here, we revert to default
+    pass
+
+# Settings for individual providers, from their [provider:<name>] sections
+def read_provider_config(config):
+  provider_config = {}
+  for section in config.sections():
+    if section.startswith("provider:"):
+      provider_config[section[len("provider:"):]] = dict(config.items(section))
+  return provider_config
+
+provider_config = read_provider_config(config)
+
+# Remote targets to monitor instead of this machine, from their
+# [target:<name>] sections, and how many to poll at once
+def read_targets(config):
+  targets = {}
+  for section in config.sections():
+    if section.startswith("target:"):
+      targets[section[len("target:"):]] = dict(config.items(section))
+  return targets
+
+targets = read_targets(config)
+
+target_workers = None
+try:
+  target_workers = config.getint("doppler-agent", "target_workers")
+except ConfigParser.Error:
+  # Do nothing here, we revert to default
+  pass
+
 # Check the ApiKey format
 if api_key is None or (len(api_key) < 3 and len(api_key) > 9):
   exit_with_error("The Api Key configured is not correct. Please check your Api Key.")
 
-# Verify with Doppler that the ApiKey looks good
-try:
-  response = urllib.urlopen("http://get.doppler.io/" + api_key + "/check")
-  if response.getcode() != 200:
-    exit_with_error("The Api Key configured is not correct. Please check your Api Key.")
-except IOError: 
-  # Do nothing here, we just let it pass, as it would be unreasonable to stop the agent for this
-  pass
+# Verify with Doppler that the ApiKey looks good, in the background so that
+# collection starts straight away rather than waiting on the network
+def check_api_key():
+  try:
+    response = urllib.urlopen("http://get.doppler.io/" + api_key + "/check")
+    if response.getcode() != 200:
+      print "The Api Key configured is not correct. Please check your Api Key."
+      # sys.exit only ends this thread, so exit the whole agent
+      os._exit(1)
+  except IOError: 
+    # Do nothing here, we just let it pass, as it would be unreasonable to stop the agent for this
+    pass
+
+key_check = threading.Thread(target=check_api_key)
+key_check.daemon = True
+key_check.start()
   
+# In multi-host mode, monitor the configured targets rather than this machine
+if targets:
+  fleet = Fleet(api_key, targets, endpoint, send_interval, spool_dir, spool_max_bytes, compress, wire_format, target_workers)
+
+  # Reload the targets and their settings on SIGHUP
+  def reload_targets(signum, frame):
+    config = ConfigParser.RawConfigParser()
+    try:
+      config.read(config_filename)
+    except ConfigParser.Error as e:
+      # Keep running with the current targets until the file is fixed
+      print "Couldn't reload targets from %s, keeping the current ones: %s" % (config_filename, e)
+      return
+    fleet.configure_targets(read_targets(config))
+    print "Reloaded targets from %s, monitoring %d targets" % (config_filename, len(fleet.collectors))
+
+  signal.signal(signal.SIGHUP, reload_targets)
+
+  print "Starting Doppler Monitoring Agent v%s" % version
+  print
+  print "API Key: %s" % api_key
+  print
+  print "Monitoring %d targets" % len(fleet.collectors)
+  for target in fleet.collectors:
+    print "%s\n    Machine ID: %s, Provider: %s" % (target.hostname, target.machine_id, ", ".join(p.__name__ for p in target.active_providers()))
+  print
+
+  fleet.start()
+  exit_with_error("None of the configured targets can be monitored.")
+
 # Load useful machine info
 hostname = socket.gethostname()
 machine_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, hostname))
 
 # Create a metrics collector
-collector = Collector(api_key, machine_id, hostname, endpoint, send_interval)
+collector = Collector(api_key, machine_id, hostname, endpoint, send_interval, spool_dir, spool_max_bytes, compress, rollup_window, rollup_after, wire_format, runtime, provider_config)
+
+# Reload the providers' settings on SIGHUP
+def reload_provider_config(signum, frame):
+  config = ConfigParser.RawConfigParser()
+  try:
+    config.read(config_filename)
+  except ConfigParser.Error as e:
+    # Keep running with the current settings until the file is fixed
+    print "Couldn't reload provider settings from %s, keeping the current ones: %s" % (config_filename, e)
+    return
+  collector.configure_providers(read_provider_config(config))
+  print "Reloaded provider settings from %s" % config_filename
+
+signal.signal(signal.SIGHUP, reload_provider_config)
 
 # Print startup banner
 print "Starting Doppler Monitoring Agent v%s" % version
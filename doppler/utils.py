@@ -1,5 +1,7 @@
 import logging
+import resource
 import sys
+import zlib
 
 logging.basicConfig(format='%(asctime)s - %(levelname)s: %(message)s', level=logging.DEBUG)
 logger = logging.getLogger("doppler")
@@ -27,4 +29,41 @@ def trim_docstring(docstring):
     while trimmed and not trimmed[0]:
         trimmed.pop(0)
     # Return a single string:
-    return '\n'.join(trimmed)
\ No newline at end of file
+    return '\n'.join(trimmed)
+
+# getrusage can report the calling thread's usage on Linux, though Python 2
+# doesn't name the constant
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", 1 if sys.platform.startswith("linux") else None)
+
+def thread_cpu_time():
+    "CPU time used by the calling thread in seconds, or None where that can't be measured."
+
+    if RUSAGE_THREAD is None:
+        return None
+    usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+def gzip_chunks(chunks, compresslevel=6):
+    "Gzip an iterable of strings, yielding the compressed data as it becomes available."
+
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def buffer_chunks(chunks, size=16 * 1024):
+    "Join an iterable of small strings into strings of at least the given size."
+
+    buffered = []
+    buffered_size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield "".join(buffered)
+            buffered = []
+            buffered_size = 0
+    if buffered:
+        yield "".join(buffered)
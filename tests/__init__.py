@@ -0,0 +1,4 @@
+import logging
+
+# The agent logs every collected value, which would drown out test output
+logging.getLogger("doppler").setLevel(logging.CRITICAL)
@@ -0,0 +1,56 @@
+import signal
+import threading
+import time
+import unittest
+
+from doppler.agent.providers.common.agent import events
+from doppler.agent.collector import ValueStore
+
+class SlowCollector(object):
+    "Stands in for a collector whose endpoint takes a while to answer."
+
+    def __init__(self):
+        self.sending = threading.Event()
+        self.answer = threading.Event()
+        self.sent = []
+
+    def transmit_payload(self, transmit_all=False):
+        self.sending.set()
+        self.answer.wait(5)
+        self.sent.append(transmit_all)
+        return True
+
+class StartedEventTest(unittest.TestCase):
+    def setUp(self):
+        self.handlers = dict((signum, signal.getsignal(signum)) for signum in (signal.SIGINT, signal.SIGTERM))
+        self.collector = SlowCollector()
+        self.events_store = ValueStore()
+        self.provider = events(self.collector, None, None, self.events_store)
+
+    def tearDown(self):
+        self.collector.answer.set()
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+
+    def test_starting_doesnt_send(self):
+        self.provider.on_start()
+        self.assertEqual([name for _, name, _ in self.events_store.get_completed()[1]], ["agent.started"])
+        self.assertFalse(self.collector.sending.is_set())
+
+    def test_sends_in_the_background_once_running(self):
+        self.provider.on_start()
+        start = time.time()
+        self.provider.begin()
+        self.assertLess(time.time() - start, 1)
+
+        self.assertTrue(self.collector.sending.wait(1))
+        self.assertEqual(self.collector.sent, [])
+        self.collector.answer.set()
+        for _ in range(100):
+            if self.collector.sent:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.collector.sent, [True])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from doppler.agent.providers.linux.system import cgroups
+
+def write(root, path, contents):
+    filename = os.path.join(root, path.lstrip("/"))
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, "w") as f:
+        f.write(contents)
+
+class RecordingCgroups(cgroups):
+    def __init__(self, root):
+        cgroups.__init__(self, None, None, None, None)
+        self.root = root
+        self.values = {}
+
+    def metric(self, name, value):
+        self.values[name] = value
+
+    def sample(self, elapsed=None):
+        "Take a sample, pretending the previous one was elapsed seconds ago."
+
+        if elapsed is not None:
+            self.previous_time -= elapsed
+        self.values = {}
+        self.fetch_value()
+        return self.values
+
+class CgroupsV2Test(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write(self.root, "cgroup.controllers", "cpu io memory\n")
+        write(self.root, "cpu.stat", "usage_usec 1\n")
+        self.container("/docker/abc", cpu=0, memory=64 * 1048576, limit="268435456")
+        self.container("/system.slice/sshd.service", cpu=0, memory=1048576, limit="max")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def container(self, path, cpu, memory, limit, throttled=0, read=0, written=0):
+        write(self.root, path + "/cpu.stat", "usage_usec %d\nuser_usec 0\nsystem_usec 0\nnr_periods 100\nnr_throttled %d\nthrottled_usec %d\n" % (cpu, throttled, throttled * 1000))
+        write(self.root, path + "/memory.current", "%d\n" % memory)
+        write(self.root, path + "/memory.max", limit + "\n")
+        write(self.root, path + "/io.stat", "8:0 rbytes=%d wbytes=%d rios=1 wios=1\n8:16 rbytes=0 wbytes=%d rios=0 wios=1\n" % (read, written, written))
+
+    def test_memory(self):
+        values = RecordingCgroups(self.root).sample()
+
+        self.assertEqual(values["system.cgroup.memory_used:/docker/abc"], 64.0)
+        self.assertEqual(values["system.cgroup.memory_limit:/docker/abc"], 256.0)
+        self.assertEqual(values["system.cgroup.memory_used:/system.slice/sshd.service"], 1.0)
+        self.assertNotIn("system.cgroup.memory_limit:/system.slice/sshd.service", values)
+        self.assertFalse([name for name in values if name.endswith(":/")])
+
+    def test_rates(self):
+        provider = RecordingCgroups(self.root)
+        provider.sample()
+        self.container("/docker/abc", cpu=5 * 10 ** 6, memory=64 * 1048576, limit="max", throttled=25, read=10 * 1048576, written=1048576)
+        values = provider.sample(elapsed=10)
+
+        self.assertAlmostEqual(values["system.cgroup.cpu_used:/docker/abc"], 50.0, places=0)
+        self.assertEqual(values["system.cgroup.cpu_throttled:/docker/abc"], 0.0)
+        self.assertAlmostEqual(values["system.cgroup.io_read:/docker/abc"], 1048576, delta=1024)
+        self.assertAlmostEqual(values["system.cgroup.io_write:/docker/abc"], 209715, delta=1024)
+
+    def test_finds_new_and_removed_cgroups(self):
+        provider = RecordingCgroups(self.root)
+        provider.sample()
+        open_files = provider.open_files
+
+        self.container("/docker/def", cpu=0, memory=2 * 1048576, limit="max")
+        shutil.rmtree(os.path.join(self.root, "system.slice", "sshd.service"))
+        values = provider.sample(elapsed=10)
+
+        self.assertEqual(values["system.cgroup.memory_used:/docker/def"], 2.0)
+        self.assertNotIn("system.cgroup.memory_used:/system.slice/sshd.service", values)
+        self.assertNotIn("/system.slice/sshd.service", provider.files)
+        self.assertEqual(provider.open_files, open_files)
+
+    def test_max_depth_and_exclusions(self):
+        self.container("/kubepods/burstable/pod1/container1/too-deep", cpu=0, memory=1048576, limit="max")
+        provider = RecordingCgroups(self.root)
+        provider.configure({"exclude_cgroups": "^/system.slice"})
+        values = provider.sample()
+
+        self.assertNotIn("system.cgroup.memory_used:/kubepods/burstable/pod1/container1/too-deep", values)
+        self.assertIn("/kubepods/burstable/pod1/container1", provider.children)
+        self.assertNotIn("system.cgroup.memory_used:/system.slice/sshd.service", values)
+        self.assertIn("system.cgroup.memory_used:/docker/abc", values)
+
+class CgroupsV1Test(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.container("/docker/abc", cpu=0, memory=32 * 1048576, limit=2 ** 63 - 4096, read=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def container(self, path, cpu, memory, limit, read):
+        write(self.root, "cpuacct" + path + "/cpuacct.usage", "%d\n" % cpu)
+        write(self.root, "cpu" + path + "/cpu.stat", "nr_periods 10\nnr_throttled 0\nthrottled_time 0\n")
+        write(self.root, "memory" + path + "/memory.usage_in_bytes", "%d\n" % memory)
+        write(self.root, "memory" + path + "/memory.limit_in_bytes", "%d\n" % limit)
+        write(self.root, "blkio" + path + "/blkio.throttle.io_service_bytes", "8:0 Read %d\n8:0 Write 0\n8:0 Total %d\nTotal %d\n" % (read, read, read))
+
+    def test_counters(self):
+        provider = RecordingCgroups(self.root)
+        values = provider.sample()
+        self.assertEqual(provider.version, 1)
+        self.assertEqual(values["system.cgroup.memory_used:/docker/abc"], 32.0)
+        self.assertNotIn("system.cgroup.memory_limit:/docker/abc", values)
+
+        self.container("/docker/abc", cpu=2 * 10 ** 9, memory=32 * 1048576, limit=1073741824, read=1048576)
+        values = provider.sample(elapsed=10)
+        self.assertAlmostEqual(values["system.cgroup.cpu_used:/docker/abc"], 20.0, places=0)
+        self.assertEqual(values["system.cgroup.memory_limit:/docker/abc"], 1024.0)
+        self.assertAlmostEqual(values["system.cgroup.io_read:/docker/abc"], 104857, delta=1024)
+
+if __name__ == "__main__":
+    unittest.main()
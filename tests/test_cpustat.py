@@ -0,0 +1,46 @@
+import unittest
+from StringIO import StringIO
+
+from doppler.agent.collector import ValueStore
+from doppler.agent.providers.linux.system import cpustat
+
+FIRST = """cpu  100 0 100 700 100 0 0 0 0 0
+cpu0 50 0 50 350 50 0 0 0 0 0
+cpu1 50 0 50 350 50 0 0 0 0 0
+intr 12345
+"""
+
+SECOND = """cpu  200 0 200 1400 200 0 0 0 0 0
+cpu0 150 0 50 750 50 0 0 0 0 0
+cpu1 50 0 150 650 150 0 0 0 0 0
+intr 23456
+"""
+
+class CpustatTest(unittest.TestCase):
+    def sample(self, per_core="yes"):
+        store = ValueStore()
+        provider = cpustat(None, store, None, None)
+        provider.configure({"per_core": per_core})
+        provider.parser(StringIO(FIRST))
+        provider.parser(StringIO(SECOND))
+        return dict((name, value) for _, name, value in store.get_completed()[1])
+
+    def test_totals_and_cores_are_separate_series(self):
+        values = self.sample()
+        self.assertEqual(values["system.cpu.used"], 30.0)
+        self.assertEqual(values["system.cpu.core.used:cpu0"], 20.0)
+        self.assertEqual(values["system.cpu.core.system:cpu1"], 20.0)
+        self.assertEqual(values["system.cpu.core.io_wait:cpu1"], 20.0)
+        self.assertNotIn("system.cpu.used:cpu0", values)
+
+    def test_every_series_is_described(self):
+        for name in self.sample():
+            family, _, instance = name.partition(":")
+            self.assertIn(family, cpustat.metrics)
+            self.assertEqual(bool(instance), cpustat.metrics[family].get("multi", False))
+
+    def test_cores_can_be_left_out(self):
+        self.assertEqual(sorted(self.sample(per_core="no")), sorted("system.cpu.%s" % name for name in ("user", "system", "idle", "io_wait", "used")))
+
+if __name__ == "__main__":
+    unittest.main()
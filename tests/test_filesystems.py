@@ -0,0 +1,73 @@
+import os
+import threading
+import time
+import unittest
+
+from doppler.agent.providers.linux.system import filesystems
+
+class ParseMountinfoTest(unittest.TestCase):
+    def parse(self, lines):
+        return filesystems(None, None, None, None).parse_mountinfo(lines)
+
+    def test_btrfs_subvolumes(self):
+        mounts = self.parse([
+            "29 1 0:26 /@ / rw,relatime shared:1 - btrfs /dev/sda2 rw,subvol=/@",
+            "30 29 8:1 / /boot rw,relatime shared:2 - ext4 /dev/sda1 rw",
+            "31 29 0:26 /@home /home rw,relatime shared:3 - btrfs /dev/sda2 rw,subvol=/@home",
+        ])
+        self.assertEqual(mounts, [("/", "btrfs"), ("/boot", "ext4")])
+
+    def test_bind_mounts(self):
+        mounts = self.parse([
+            "40 1 8:1 /var/lib/data /srv/data rw - ext4 /dev/sda1 rw",
+            "41 1 8:1 / / rw - ext4 /dev/sda1 rw",
+            "42 1 8:1 / /mnt/again rw - ext4 /dev/sda1 rw",
+            "43 1 8:17 /exports /exports rw - xfs /dev/sdb1 rw",
+        ])
+        self.assertEqual(mounts, [("/", "ext4"), ("/exports", "xfs")])
+
+    def test_exclusions(self):
+        mounts = self.parse([
+            "20 1 0:5 / /proc rw - proc proc rw",
+            "21 1 0:6 / /run rw - tmpfs tmpfs rw",
+            "22 1 8:1 / / rw - ext4 /dev/sda1 rw",
+            "23 1 8:2 / /mnt/with\\040space rw - ext4 /dev/sda2 rw",
+        ])
+        self.assertEqual(mounts, [("/", "ext4"), ("/mnt/with space", "ext4")])
+
+class HangingFilesystems(filesystems):
+    mount_timeout = 0.1
+
+    def __init__(self, mounts):
+        filesystems.__init__(self, None, None, None, None)
+        self.mounts = mounts
+        self.values = {}
+        self.released = threading.Event()
+
+    def read_mounts(self):
+        return self.mounts
+
+    def statvfs(self, mountpoint, results):
+        if mountpoint != "/":
+            self.released.wait()
+        results[mountpoint] = os.statvfs("/")
+
+    def metric(self, name, value):
+        self.values[name] = value
+
+class StatvfsTimeoutTest(unittest.TestCase):
+    def test_fuse_mounts_are_timed_out(self):
+        provider = HangingFilesystems([("/", "ext4"), ("/mnt/bucket", "fuse.s3fs"), ("/mnt/scratch", "lustre")])
+        try:
+            start = time.time()
+            provider.fetch_value()
+            self.assertLess(time.time() - start, 1)
+        finally:
+            provider.released.set()
+
+        self.assertIn("system.fs.used_bytes:/", provider.values)
+        self.assertNotIn("system.fs.used_bytes:/mnt/bucket", provider.values)
+        self.assertEqual(sorted(provider.hung), ["/mnt/bucket", "/mnt/scratch"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+
+from doppler.agent.fleet import Fleet
+from tests.test_transport import StandInServer
+
+class StubCollector(object):
+    def __init__(self, sent, unavailable=False):
+        self.sent = sent
+        self.unavailable = unavailable
+        self.attempts = 0
+
+    def transmit_payload(self, transmit_all=False):
+        self.attempts += 1
+        return self.sent
+
+class TransmitPayloadsTest(unittest.TestCase):
+    def fleet(self, collectors):
+        fleet = Fleet("key", {})
+        fleet.collectors = collectors
+        return fleet
+
+    def test_rejected_payload_doesnt_hold_back_other_targets(self):
+        collectors = [StubCollector(True), StubCollector(False), StubCollector(True)]
+        self.assertTrue(self.fleet(collectors).transmit_payloads())
+        self.assertEqual([c.attempts for c in collectors], [1, 1, 1])
+
+    def test_stops_when_the_endpoint_cant_be_reached(self):
+        collectors = [StubCollector(True), StubCollector(False, unavailable=True), StubCollector(True)]
+        self.assertFalse(self.fleet(collectors).transmit_payloads())
+        self.assertEqual([c.attempts for c in collectors], [1, 1, 0])
+
+class EndpointStatusTest(unittest.TestCase):
+    "Sends from real collectors to a stand-in endpoint answering with a fixed status."
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def transmit(self, status):
+        self.server = StandInServer(status=status)
+        targets = dict(("cache-%d" % i, {"type": "redis", "address": "127.0.0.1:%d" % (6379 + i)}) for i in range(3))
+        fleet = Fleet("key", targets, endpoint=self.server.endpoint)
+        return fleet.transmit_payloads()
+
+    def test_server_errors_back_off_the_fleet(self):
+        self.assertFalse(self.transmit(503))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_rate_limiting_backs_off_the_fleet(self):
+        self.assertFalse(self.transmit(429))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_rejections_stay_with_their_target(self):
+        self.assertTrue(self.transmit(400))
+        self.assertEqual(len(self.server.requests), 3)
+
+class ConfigureTargetsTest(unittest.TestCase):
+    "Reloads the targets of a fleet whose collectors have been started."
+
+    def setUp(self):
+        self.fleet = Fleet("key", {
+            "cache-1": {"type": "redis", "address": "10.0.0.5:6379"},
+            "cache-2": {"type": "redis", "address": "10.0.0.6:6379"},
+        })
+        for collector in self.fleet.collectors:
+            collector.start_providers()
+        self.fleet.started = True
+
+    def provider(self, name):
+        return self.fleet.targets[name].providers["redisInfo"]
+
+    def test_changed_settings_are_applied_in_place(self):
+        collector = self.fleet.targets["cache-1"]
+        provider = self.provider("cache-1")
+        self.fleet.configure_targets({
+            "cache-1": {"type": "redis", "address": "10.0.0.7:6379", "interval": "30"},
+            "cache-2": {"type": "redis", "address": "10.0.0.6:6379"},
+        })
+        self.assertIs(self.fleet.targets["cache-1"], collector)
+        self.assertIs(self.provider("cache-1"), provider)
+        self.assertEqual(provider.instances, "10.0.0.7:6379")
+        self.assertEqual(provider.interval, 30)
+
+    def test_targets_are_added_and_removed(self):
+        removed = self.fleet.targets["cache-2"]
+        self.fleet.configure_targets({
+            "cache-1": {"type": "redis", "address": "10.0.0.5:6379"},
+            "lb-1": {"type": "http", "address": "http://10.0.0.9:8080/stats.json"},
+        })
+        self.assertEqual([c.hostname for c in self.fleet.collectors], ["cache-1", "lb-1"])
+        self.assertEqual(removed.providers, {})
+        self.assertTrue(self.fleet.targets["lb-1"].providers)
+
+    def test_new_hostname_is_a_new_machine(self):
+        collector = self.fleet.targets["cache-1"]
+        self.fleet.configure_targets({
+            "cache-1": {"type": "redis", "address": "10.0.0.5:6379", "hostname": "cache-1.example.com"},
+            "cache-2": {"type": "redis", "address": "10.0.0.6:6379"},
+        })
+        self.assertIsNot(self.fleet.targets["cache-1"], collector)
+        self.assertEqual(self.fleet.targets["cache-1"].hostname, "cache-1.example.com")
+        self.assertEqual(collector.providers, {})
+
+    def test_invalid_targets_are_stopped(self):
+        collector = self.fleet.targets["cache-2"]
+        self.fleet.configure_targets({
+            "cache-1": {"type": "redis", "address": "10.0.0.5:6379"},
+            "cache-2": {"type": "memcached", "address": "10.0.0.6:11211"},
+        })
+        self.assertEqual(sorted(self.fleet.targets), ["cache-1"])
+        self.assertEqual(collector.providers, {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import random
+import unittest
+
+from doppler.agent import gorilla
+from doppler.agent.gorilla import encode, decode, float_to_bits
+
+class GorillaTest(unittest.TestCase):
+    def assertRoundTrips(self, timestamps, values):
+        decoded_timestamps, decoded_values = decode(encode(timestamps, values))
+        self.assertEqual(decoded_timestamps, list(timestamps))
+
+        # Compare the bits, so NaNs and -0.0 count as equal to themselves
+        self.assertEqual([float_to_bits(v) for v in decoded_values], [float_to_bits(v) for v in values])
+
+    def test_empty(self):
+        self.assertRoundTrips([], [])
+        self.assertEqual(decode(encode([], [])), ([], []))
+
+    def test_single(self):
+        self.assertRoundTrips([1400000000], [1.5])
+
+    def test_regular_series(self):
+        timestamps = range(1400000000, 1400000000 + 5 * 1000, 5)
+        self.assertRoundTrips(timestamps, [12.0] * 1000)
+        self.assertRoundTrips(timestamps, [float(i % 17) for i in range(1000)])
+
+    def test_special_values(self):
+        values = [0.0, -0.0, float("nan"), float("inf"), float("-inf"), 1e-310, -1e308, 5e-324, 1.0, float("nan"), -0.0]
+        self.assertRoundTrips(range(len(values)), values)
+
+    def test_timestamp_jumps(self):
+        timestamps = [0, 1, 2, 100, 101, 10 ** 6, 10 ** 6 + 1, 2 ** 40, 2 ** 62, 2 ** 62 + 64, 2 ** 62 + 64 + 2 ** 12]
+        self.assertRoundTrips(timestamps, [1.0] * len(timestamps))
+
+    def test_negative_timestamps_and_deltas(self):
+        timestamps = [-2 ** 62, -5, -5, 0, 10, 5, -2 ** 40, 2 ** 40]
+        self.assertRoundTrips(timestamps, [float(i) for i in range(len(timestamps))])
+
+    def test_dod_encoding_boundaries(self):
+        timestamps = [0]
+        delta = 0
+        for _, _, value_bits in gorilla.DOD_ENCODINGS[:-1]:
+            limit = 1 << (value_bits - 1)
+            for dod in (limit - 1, limit, limit + 1, -limit, -limit + 1, -limit - 1):
+                delta += dod
+                timestamps.append(timestamps[-1] + delta)
+        self.assertRoundTrips(timestamps, [0.0] * len(timestamps))
+
+    def test_random(self):
+        generator = random.Random(1)
+        for i in range(200):
+            count = generator.randint(0, 50)
+            timestamps = [generator.choice((0, 1, 5, 60, generator.randint(-2 ** 20, 2 ** 20))) for _ in range(count)]
+            for j in range(1, count):
+                timestamps[j] += timestamps[j - 1]
+            values = [generator.choice((
+                generator.random(), float(generator.randint(0, 10)), generator.uniform(-1e300, 1e300), float("nan"), -0.0
+            )) for _ in range(count)]
+            self.assertRoundTrips(timestamps, values)
+
+    def test_compresses_regular_series(self):
+        timestamps = range(1400000000, 1400000000 + 10 * 1000, 10)
+        data = encode(timestamps, [42.0] * 1000)
+        self.assertLess(len(data), 16 * 1000 / 20)
+
+if __name__ == "__main__":
+    unittest.main()
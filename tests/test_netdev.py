@@ -0,0 +1,23 @@
+import unittest
+
+from doppler.agent.providers.linux.system import counter_delta
+
+class CounterDeltaTest(unittest.TestCase):
+    def test_increase(self):
+        self.assertEqual(counter_delta(150, 100), 50)
+        self.assertEqual(counter_delta(100, 100), 0)
+
+    def test_32_bit_wrap(self):
+        self.assertEqual(counter_delta(100, 2 ** 32 - 50, kernel_64_bit=False), 150)
+        self.assertEqual(counter_delta(100, 2 ** 32 - 50, kernel_64_bit=True), 150)
+
+    def test_reset(self):
+        self.assertIsNone(counter_delta(100, 10 ** 6, kernel_64_bit=True))
+        self.assertIsNone(counter_delta(100, 2 ** 40, kernel_64_bit=True))
+        self.assertIsNone(counter_delta(100, 2 ** 40, kernel_64_bit=False))
+
+    def test_any_drop_below_the_limit_wraps_on_32_bit_kernels(self):
+        self.assertEqual(counter_delta(100, 10 ** 6, kernel_64_bit=False), 2 ** 32 - 10 ** 6 + 100)
+
+if __name__ == "__main__":
+    unittest.main()
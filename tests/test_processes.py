@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from doppler.agent.providers.linux.system import processes
+
+def write_stat(root, pid, name, ticks, rss_pages, start_time=1000):
+    directory = os.path.join(root, str(pid))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # pid (comm) state, then fields from ppid on, with utime, stime,
+    # starttime and rss at 11, 12, 19 and 21
+    fields = ["0"] * 22
+    fields[0] = "S"
+    fields[11] = str(ticks)
+    fields[19] = str(start_time)
+    fields[21] = str(rss_pages)
+    with open(os.path.join(directory, "stat"), "w") as f:
+        f.write("%d (%s) %s\n" % (pid, name, " ".join(fields)))
+
+class RecordingProcesses(processes):
+    def __init__(self, root):
+        processes.__init__(self, None, None, None, None)
+        self.PROC_PATH = root
+        self.clock_ticks = 100.0
+        self.page_size = 1024 * 1024
+        self.values = {}
+        self.state_values = {}
+
+    def metric(self, name, value):
+        self.values[name] = value
+
+    def state(self, name, value):
+        self.state_values[name] = value
+
+    def sample(self, elapsed=None):
+        "Take a sample, pretending the previous one was elapsed seconds ago."
+
+        if elapsed is not None:
+            self.previous_time -= elapsed
+        self.values = {}
+        self.fetch_value()
+
+class ProcessesTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        write_stat(self.root, 100, "postgres", 0, 10)
+        write_stat(self.root, 101, "postgres", 0, 20)
+        write_stat(self.root, 200, "my (odd) name", 0, 5)
+        self.provider = RecordingProcesses(self.root)
+        self.provider.sample()
+
+    def tearDown(self):
+        for handle in self.provider.handles.values():
+            handle.close()
+        shutil.rmtree(self.root)
+
+    def test_processes_of_the_same_name_are_one_series(self):
+        self.assertEqual(self.provider.values, {
+            "system.process.memory:postgres": 30.0,
+            "system.process.memory:my (odd) name": 5.0,
+        })
+
+        write_stat(self.root, 100, "postgres", 100, 10)
+        write_stat(self.root, 101, "postgres", 50, 20)
+        write_stat(self.root, 200, "my (odd) name", 200, 5)
+        self.provider.sample(elapsed=10)
+
+        values = self.provider.values
+        self.assertAlmostEqual(values["system.process.cpu:postgres"], 15.0, places=0)
+        self.assertAlmostEqual(values["system.process.cpu:my (odd) name"], 20.0, places=0)
+        self.assertFalse([name for name in values if "[" in name])
+
+    def test_top_process_is_named_without_its_pid(self):
+        write_stat(self.root, 100, "postgres", 150, 10)
+        write_stat(self.root, 101, "postgres", 150, 20)
+        write_stat(self.root, 200, "my (odd) name", 200, 5)
+        self.provider.sample(elapsed=10)
+
+        self.assertEqual(self.provider.state_values["system.cpu.top_process"], "postgres")
+        self.assertAlmostEqual(self.provider.values["system.cpu.top_process_usage"], 30.0, places=0)
+
+    def test_restarted_pid_isnt_counted_from_its_old_ticks(self):
+        write_stat(self.root, 100, "postgres", 5, 10, start_time=2000)
+        self.provider.sample(elapsed=10)
+
+        self.assertEqual(self.provider.values["system.process.cpu:postgres"], 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import os
+import unittest
+
+from doppler.agent.providers import ProcFile
+
+class ProcFileTest(unittest.TestCase):
+    @unittest.skipUnless(os.path.exists("/proc/self/smaps"), "needs /proc")
+    def test_reads_multi_page_seq_files(self):
+        # smaps is seq_file backed, so it's read a page or so at a time
+        proc_file = ProcFile("/proc/self/smaps", buffer_size=256)
+        try:
+            data = proc_file.read()
+        finally:
+            proc_file.close()
+
+        with open("/proc/self/maps") as maps:
+            mappings = len(maps.readlines())
+
+        self.assertGreater(len(data), 4096)
+        self.assertEqual(data.count("\nVmFlags:"), mappings)
+        self.assertTrue(data.endswith("\n"))
+
+    @unittest.skipUnless(os.path.exists("/proc/self/mountinfo"), "needs /proc")
+    def test_rereads_from_the_start(self):
+        proc_file = ProcFile("/proc/self/mountinfo", buffer_size=16)
+        try:
+            first = proc_file.read()
+            second = proc_file.read()
+        finally:
+            proc_file.close()
+
+        with open("/proc/self/mountinfo") as mountinfo:
+            self.assertEqual(first, mountinfo.read())
+        self.assertEqual(first, second)
+
+    def test_missing_file(self):
+        proc_file = ProcFile("/proc/doesnt-exist")
+        self.assertRaises(IOError, proc_file.read)
+        self.assertIsNone(proc_file.file)
+
+if __name__ == "__main__":
+    unittest.main()
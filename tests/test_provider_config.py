@@ -0,0 +1,54 @@
+import unittest
+
+from doppler.agent.providers.linux.system import cpustat, diskstats
+
+class ConfigureTest(unittest.TestCase):
+    def provider(self, provider_class=cpustat):
+        return provider_class(None, None, None, None)
+
+    def test_options(self):
+        provider = self.provider()
+        provider.configure({"per_core": "no", "interval": "2", "timeout": "0.5", "enabled": "yes"})
+
+        self.assertEqual(provider.per_core, False)
+        self.assertEqual(provider.interval, 2)
+        self.assertEqual(provider.timeout, 0.5)
+        self.assertEqual(provider.settings, {"per_core": False, "interval": 2, "timeout": 0.5})
+
+    def test_reconfigure_restores_defaults(self):
+        provider = self.provider()
+        provider.configure({"per_core": "no"})
+        provider.configure({})
+
+        self.assertEqual(provider.per_core, True)
+        self.assertEqual(provider.settings, {})
+
+    def test_ignores_what_isnt_an_option(self):
+        provider = self.provider(diskstats)
+        provider.configure({
+            "name": "other",
+            "command": "rm -rf /",
+            "file": "/etc/shadow",
+            "metrics": "{}",
+            "SECTOR_SIZE": "1",
+            "SYS_BLOCK_PATH": "/tmp",
+            "fetch_value": "1",
+            "_command_available": "1",
+            "unknown": "1",
+        })
+
+        self.assertEqual(provider.name, "diskstats")
+        self.assertIsNone(provider.command)
+        self.assertEqual(provider.file, "/proc/diskstats")
+        self.assertEqual(provider.SECTOR_SIZE, 512)
+        self.assertEqual(provider.settings, {})
+
+    def test_ignores_invalid_values(self):
+        provider = self.provider()
+        provider.configure({"per_core": "maybe", "interval": "-1", "timeout": "soon"})
+
+        self.assertEqual(provider.per_core, True)
+        self.assertEqual(provider.settings, {})
+
+if __name__ == "__main__":
+    unittest.main()
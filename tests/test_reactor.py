@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+
+from doppler.agent.reactor import CommandReactor
+
+class Results(object):
+    def __init__(self):
+        self.outputs = {}
+        self.done = {}
+
+    def callback(self, name):
+        self.done[name] = threading.Event()
+
+        def finished(output, duration):
+            self.outputs[name] = (output, time.time())
+            self.done[name].set()
+        return finished
+
+    def wait(self, name, timeout=5):
+        self.done[name].wait(timeout)
+        return self.outputs.get(name, (None, None))
+
+class FailingOnceReactor(CommandReactor):
+    def __init__(self):
+        CommandReactor.__init__(self)
+        self.failed = False
+
+    def poll(self):
+        if not self.failed:
+            self.failed = True
+            raise OSError("interrupted")
+        CommandReactor.poll(self)
+
+class CommandReactorTest(unittest.TestCase):
+    def start(self, reactor_class=CommandReactor):
+        reactor = reactor_class()
+        reactor.start()
+        return reactor
+
+    def test_output(self):
+        results = Results()
+        self.start().spawn(["echo", "hello"], results.callback("echo"), 5)
+        self.assertEqual(results.wait("echo")[0], "hello\n")
+
+    def test_timeout(self):
+        results = Results()
+        process = self.start().spawn(["sleep", "5"], results.callback("sleep"), 0.2)
+        self.assertEqual(results.wait("sleep")[0], None)
+
+        # Killed commands are reaped on later iterations
+        deadline = time.time() + 5
+        while process.returncode is None and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertIsNotNone(process.returncode)
+
+    def test_command_that_closes_its_output_doesnt_delay_others(self):
+        results = Results()
+        reactor = self.start()
+        started = time.time()
+        reactor.spawn(["sh", "-c", "exec >&- 2>&-; sleep 1"], results.callback("lingering"), 5)
+        time.sleep(0.1)
+        reactor.spawn(["echo", "quick"], results.callback("quick"), 5)
+
+        output, finished = results.wait("quick")
+        self.assertEqual(output, "quick\n")
+        self.assertLess(finished - started, 0.5)
+
+        output, finished = results.wait("lingering")
+        self.assertEqual(output, "")
+        self.assertGreaterEqual(finished - started, 1)
+
+    def test_keeps_running_after_an_error(self):
+        results = Results()
+        self.start(FailingOnceReactor).spawn(["echo", "again"], results.callback("echo"), 5)
+        self.assertEqual(results.wait("echo")[0], "again\n")
+
+if __name__ == "__main__":
+    unittest.main()
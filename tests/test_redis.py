@@ -0,0 +1,127 @@
+import SocketServer
+import threading
+import unittest
+
+from doppler.agent.providers.common.redis import redisInfo, RedisConnection, RedisError, parse_info
+
+INFO = (
+    "# Server\r\nredis_version:%(version)s\r\n\r\n"
+    "# Memory\r\nused_memory:%(memory)d\r\n\r\n"
+    "# Clients\r\nconnected_clients:3\r\n\r\n"
+    "# Replication\r\nrole:master\r\nslave0:ip=10.0.0.2,port=6380,state=online,offset=10,lag=%(lag)d\r\n\r\n"
+    "# Stats\r\ntotal_commands_processed:%(commands)d\r\nkeyspace_hits:%(hits)d\r\nkeyspace_misses:%(misses)d\r\nevicted_keys:0\r\n\r\n"
+    "# Keyspace\r\ndb0:keys=5,expires=0,avg_ttl=0\r\ndb3:keys=2,expires=0,avg_ttl=0\r\n"
+)
+
+class RespHandler(SocketServer.StreamRequestHandler):
+    "Answers INFO and AUTH like a redis server, counting up its stats on each INFO."
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for i in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+
+            if args[0] == "AUTH":
+                if args[1] == self.server.password:
+                    self.wfile.write("+OK\r\n")
+                else:
+                    self.wfile.write("-ERR invalid password\r\n")
+                continue
+
+            self.server.requests += 1
+            n = self.server.requests
+            info = INFO % {"version": self.server.version, "memory": self.server.memory, "lag": n, "commands": n * 1000, "hits": n * 90, "misses": n * 10}
+            self.wfile.write("$%d\r\n%s\r\n" % (len(info), info))
+
+class RespServer(SocketServer.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, version="6.0.0", memory=1048576, password=None):
+        SocketServer.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), RespHandler)
+        self.version = version
+        self.memory = memory
+        self.password = password
+        self.requests = 0
+
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def address(self):
+        return "127.0.0.1:%d" % self.server_address[1]
+
+class RecordingRedisInfo(redisInfo):
+    def __init__(self, instances):
+        redisInfo.__init__(self, None, None, None, None)
+        self.configure({"instances": instances})
+        self.values = {}
+        self.states_seen = {}
+
+    def metric(self, name, value):
+        self.values[name] = value
+
+    def state(self, name, value):
+        self.states_seen[name] = value
+
+class RedisConnectionTest(unittest.TestCase):
+    def test_info(self):
+        server = RespServer()
+        connection = RedisConnection(server.address)
+        self.assertEqual(parse_info(connection.command("INFO"))["redis_version"], "6.0.0")
+        self.assertEqual(parse_info(connection.command("INFO"))["total_commands_processed"], "2000")
+        connection.close()
+        server.shutdown()
+
+    def test_auth(self):
+        server = RespServer(password="secret")
+        self.assertEqual(parse_info(RedisConnection(server.address, "secret").command("INFO"))["used_memory"], "1048576")
+        self.assertRaises(RedisError, RedisConnection(server.address, "wrong").command, "INFO")
+        server.shutdown()
+
+class RedisInfoTest(unittest.TestCase):
+    def setUp(self):
+        self.first = RespServer(version="6.0.0", memory=1048576)
+        self.second = RespServer(version="7.0.0", memory=2097152)
+
+    def tearDown(self):
+        self.first.shutdown()
+        self.second.shutdown()
+
+    def test_unlabelled_series_is_the_first_instance(self):
+        provider = RecordingRedisInfo("%s, %s" % (self.first.address, self.second.address))
+        provider.fetch_value()
+
+        self.assertEqual(provider.states_seen["system.packages.version.redis"], "6.0.0")
+        self.assertEqual(provider.values["service.redis.used_memory"], 1024)
+        self.assertEqual(provider.values["service.redis.instance_used_memory:%s" % self.first.address], 1024)
+        self.assertEqual(provider.values["service.redis.instance_used_memory:%s" % self.second.address], 2048)
+        self.assertEqual(provider.values["service.redis.keys:%s" % self.second.address], 7)
+        self.assertEqual(provider.values["service.redis.keys:%s/db3" % self.second.address], 2)
+        self.assertEqual(provider.values["service.redis.replication_lag:%s" % self.first.address], 1)
+
+    def test_rates(self):
+        provider = RecordingRedisInfo(self.first.address)
+        provider.fetch_value()
+        self.assertNotIn("service.redis.hit_ratio:%s" % self.first.address, provider.values)
+
+        provider.fetch_value()
+        self.assertEqual(provider.values["service.redis.hit_ratio:%s" % self.first.address], 90.0)
+        self.assertGreater(provider.values["service.redis.ops_per_sec:%s" % self.first.address], 0)
+
+    def test_unreachable_first_instance(self):
+        provider = RecordingRedisInfo("127.0.0.1:1, %s" % self.second.address)
+        provider.fetch_value()
+
+        self.assertIsNone(provider.states_seen["system.packages.version.redis"])
+        self.assertNotIn("service.redis.used_memory", provider.values)
+        self.assertEqual(provider.values["service.redis.instance_used_memory:%s" % self.second.address], 2048)
+
+if __name__ == "__main__":
+    unittest.main()
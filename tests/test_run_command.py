@@ -0,0 +1,84 @@
+import os
+import select
+import time
+import unittest
+
+import doppler.agent.providers as providers
+from doppler.agent.providers import run_command, kill_command, reap_killed_commands, CommandTimeout
+
+def wait_until_reaped(process, timeout=5):
+    deadline = time.time() + timeout
+    while process in providers.killed_commands and time.time() < deadline:
+        reap_killed_commands()
+        time.sleep(0.01)
+
+class StuckProcess(object):
+    "A process that takes a while to die once killed, like one in uninterruptible sleep."
+
+    pid = 99999
+    returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        raise AssertionError("waited on a stuck process")
+
+class RunCommandTest(unittest.TestCase):
+    def test_output(self):
+        self.assertEqual(run_command(["sh", "-c", "echo out; echo err >&2"], 5), "out\n")
+
+    def test_timeout_kills_the_process_group(self):
+        start = time.time()
+        self.assertRaises(CommandTimeout, run_command, ["sh", "-c", "sleep 5 & sleep 5"], 0.2)
+        self.assertLess(time.time() - start, 2)
+
+    def test_kills_and_reaps_the_command_on_other_errors(self):
+        spawned = []
+
+        def spawn_command(args):
+            process = original_spawn(args)
+            spawned.append(process)
+            return process
+
+        def interrupted_select(*args):
+            raise select.error(4, "Interrupted system call")
+
+        original_spawn, original_select = providers.spawn_command, providers.select.select
+        providers.spawn_command, providers.select.select = spawn_command, interrupted_select
+        try:
+            self.assertRaises(select.error, run_command, ["sleep", "5"], 5)
+        finally:
+            providers.spawn_command, providers.select.select = original_spawn, original_select
+
+        wait_until_reaped(spawned[0])
+        self.assertIsNotNone(spawned[0].returncode)
+        self.assertRaises(OSError, os.kill, spawned[0].pid, 0)
+
+class KillCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.killpg = os.killpg
+        os.killpg = lambda pid, signum: None
+
+    def tearDown(self):
+        os.killpg = self.killpg
+        providers.killed_commands.clear()
+
+    def test_doesnt_wait_for_the_command_to_exit(self):
+        process = StuckProcess()
+        kill_command(process)
+        self.assertIn(process, providers.killed_commands)
+
+        self.assertEqual(reap_killed_commands(), 1)
+        process.returncode = -9
+        self.assertEqual(reap_killed_commands(), 0)
+        self.assertNotIn(process, providers.killed_commands)
+
+    def test_command_that_has_exited_isnt_kept(self):
+        process = StuckProcess()
+        process.returncode = -9
+        kill_command(process)
+        self.assertNotIn(process, providers.killed_commands)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import errno
+import shutil
+import tempfile
+import time
+import unittest
+
+from doppler.agent.collector import ValueStore
+from doppler.agent.spool import Spool
+
+class FullDiskFile(object):
+    "A segment file whose writes fail with ENOSPC while its spool's disk is full."
+
+    def __init__(self, spool, file):
+        self.spool = spool
+        self.file = file
+
+    def check(self):
+        if self.spool.disk_full:
+            raise IOError(errno.ENOSPC, "No space left on device")
+
+    def write(self, data):
+        self.check()
+        self.file.write(data)
+
+    def flush(self):
+        self.check()
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+class FullDiskSpool(Spool):
+    RETRY_INTERVAL = 0.05
+
+    disk_full = False
+
+    def roll(self, seq):
+        self.check()
+        Spool.roll(self, seq)
+        self.file = FullDiskFile(self, self.file)
+
+    def write_ack(self):
+        self.check()
+        Spool.write_ack(self)
+
+    def check(self):
+        if self.disk_full:
+            raise IOError(errno.ENOSPC, "No space left on device")
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def store(self, spool_class=Spool, **kwargs):
+        return ValueStore(spool=spool_class(self.path, sync_items=1, **kwargs))
+
+    def collect(self, store, start, count):
+        for i in range(start, start + count):
+            store.collect("metric", i, ts=1000 + i)
+
+    def values(self, store):
+        return [value for _, _, value in store.get_completed()[1]]
+
+    def test_replays_unacknowledged_items(self):
+        store = self.store()
+        self.collect(store, 0, 10)
+        seq, items = store.get_completed(before=1004)
+        store.acknowledge(seq + len(items))
+        store.sync()
+
+        self.assertEqual(self.values(self.store()), range(4, 10))
+
+    def test_full_disk_keeps_items_in_memory(self):
+        store = self.store(FullDiskSpool)
+        self.collect(store, 0, 5)
+
+        store.spool.disk_full = True
+        self.collect(store, 5, 5)
+        store.sync()
+        self.assertIsNotNone(store.spool.failed_at)
+        self.assertEqual(self.values(store), range(10))
+
+        seq, items = store.get_completed(before=1003)
+        store.acknowledge(seq + len(items))
+        self.assertEqual(self.values(store), range(3, 10))
+
+    def test_resumes_once_writes_succeed(self):
+        store = self.store(FullDiskSpool)
+        self.collect(store, 0, 5)
+        store.spool.disk_full = True
+        self.collect(store, 5, 5)
+
+        store.spool.disk_full = False
+        time.sleep(FullDiskSpool.RETRY_INTERVAL)
+        self.collect(store, 10, 5)
+        store.sync()
+        self.assertIsNone(store.spool.failed_at)
+        self.assertEqual(self.values(store), range(15))
+
+        # Only what was spooled after resuming survives a restart, numbered
+        # as it was before
+        replayed = self.store()
+        seq, items = replayed.get_completed()
+        self.assertEqual(seq, 10)
+        self.assertEqual([value for _, _, value in items], range(10, 15))
+        replayed.acknowledge(12)
+        self.assertEqual(self.values(replayed), range(12, 15))
+
+    def test_size_cap_drops_items_from_memory_too(self):
+        store = self.store(max_bytes=200, segment_bytes=100)
+        self.collect(store, 0, 40)
+
+        values = self.values(store)
+        self.assertLess(len(values), 40)
+        self.assertEqual(values, range(40 - len(values), 40))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import BaseHTTPServer
+import SocketServer
+import threading
+import unittest
+
+from doppler.agent.transport import HttpTransport
+
+class RecordingHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    "Records each request's body and the client port it came from."
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            body = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                body.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = "".join(body)
+        else:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.client_address[1], body))
+        self.respond()
+
+    def do_GET(self):
+        self.server.requests.append((self.client_address[1], None))
+        self.respond()
+
+    def respond(self):
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "2")
+        if self.server.close_connections:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write("ok")
+
+    def log_message(self, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, status=200, close_connections=False):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), RecordingHandler)
+        self.status = status
+        self.close_connections = close_connections
+        self.requests = []
+
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def endpoint(self):
+        return "http://127.0.0.1:%d/" % self.server_address[1]
+
+class HttpTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def server(self, *args, **kwargs):
+        server = StandInServer(*args, **kwargs)
+        self.servers.append(server)
+        return server
+
+    def test_posts_share_a_connection(self):
+        server = self.server()
+        transport = HttpTransport(server.endpoint)
+
+        connect_times = []
+        for i in range(3):
+            self.assertEqual(transport.post("payload %d" % i, {}), (200, "ok"))
+            connect_times.append(transport.connect_time)
+        transport.close()
+
+        self.assertEqual([body for _, body in server.requests], ["payload 0", "payload 1", "payload 2"])
+        self.assertEqual(len(set(port for port, _ in server.requests)), 1)
+        self.assertIsNotNone(connect_times[0])
+        self.assertEqual(connect_times[1:], [None, None])
+
+    def test_chunked_post(self):
+        server = self.server()
+        transport = HttpTransport(server.endpoint)
+        chunks = ["x" * 10000, "y" * 70000, "z"]
+
+        self.assertEqual(transport.post(lambda: iter(chunks), {}), (200, "ok"))
+        self.assertEqual(server.requests[0][1], "".join(chunks))
+        self.assertEqual(transport.bytes_sent, 80001)
+        transport.close()
+
+    def test_reconnects_when_the_server_closes_the_connection(self):
+        server = self.server(close_connections=True)
+        transport = HttpTransport(server.endpoint)
+
+        for i in range(2):
+            self.assertEqual(transport.post("payload", {}), (200, "ok"))
+            self.assertIsNotNone(transport.connect_time)
+        self.assertEqual(len(set(port for port, _ in server.requests)), 2)
+
+    def test_retries_a_dropped_kept_alive_connection(self):
+        server = self.server()
+        transport = HttpTransport(server.endpoint)
+        transport.post("first", {})
+
+        # Drop the connection under the transport, as an idle timeout would
+        transport.connection.sock.close()
+        self.assertEqual(transport.post("second", {}), (200, "ok"))
+        self.assertIsNotNone(transport.connect_time)
+        self.assertEqual([body for _, body in server.requests], ["first", "second"])
+        transport.close()
+
+    def test_error_status(self):
+        server = self.server(status=503)
+        transport = HttpTransport(server.endpoint)
+        self.assertEqual(transport.post("payload", {})[0], 503)
+        self.assertEqual(transport.get()[0], 503)
+        transport.close()
+
+    def test_unreachable(self):
+        server = self.server()
+        endpoint = server.endpoint
+        server.shutdown()
+        server.server_close()
+        self.servers.remove(server)
+
+        self.assertRaises(IOError, HttpTransport(endpoint, timeout=1).post, "payload", {})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import math
+import unittest
+from array import array
+
+from doppler.agent.collector import SealedBlock, ValueStore
+
+class SealedBlockTest(unittest.TestCase):
+    def test_round_trip(self):
+        timestamps = array("l", [100, 100, 105, 105, 110, 112])
+        ids = array("l", [0, 1, 0, 1, 0, 2])
+        values = array("d", [1.0, -0.0, 1.5, float("inf"), 2.0, 7.0])
+        block = SealedBlock(10, timestamps, ids, values)
+
+        self.assertEqual((block.first_seq, block.count, block.end_seq), (10, 6, 16))
+        decoded_timestamps, decoded_ids, decoded_values = block.decode()
+        self.assertEqual(list(decoded_timestamps), list(timestamps))
+        self.assertEqual(list(decoded_ids), list(ids))
+        self.assertEqual([repr(v) for v in decoded_values], [repr(v) for v in values])
+
+    def test_nan(self):
+        block = SealedBlock(0, array("l", [1, 2]), array("l", [0, 0]), array("d", [float("nan"), 1.0]))
+        self.assertTrue(math.isnan(block.decode()[2][0]))
+
+class SealingValueStore(ValueStore):
+    SEAL_ITEMS = 8
+    COMPACT_THRESHOLD = 4
+
+class ValueStoreTest(unittest.TestCase):
+    def collect(self, store, count, start=0):
+        for i in range(start, start + count):
+            store.collect("metric.%d" % (i % 3), i, ts=1000 + i)
+
+    def test_seals_backlog_into_blocks(self):
+        store = SealingValueStore(numeric=True)
+        self.collect(store, 40)
+
+        self.assertEqual(len(store.blocks), 4)
+        self.assertEqual(len(store), 40)
+        seq, items = store.get_completed()
+        self.assertEqual(seq, 0)
+        self.assertEqual(items, [(1000 + i, "metric.%d" % (i % 3), float(i)) for i in range(40)])
+
+    def test_drain_and_acknowledge_in_chunks(self):
+        store = SealingValueStore(numeric=True)
+        self.collect(store, 40)
+
+        drained = []
+        while True:
+            seq, items = store.get_completed(limit=7)
+            if not items:
+                break
+            self.assertEqual(seq, len(drained))
+            drained.extend(items)
+            store.acknowledge(seq + len(items))
+
+        self.assertEqual([value for _, _, value in drained], [float(i) for i in range(40)])
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.blocks, [])
+
+    def test_cutoff_within_a_block(self):
+        store = SealingValueStore(numeric=True)
+        self.collect(store, 40)
+
+        seq, items = store.get_completed(before=1005)
+        self.assertEqual([ts for ts, _, _ in items], range(1000, 1005))
+        store.acknowledge(seq + len(items))
+
+        seq, items = store.get_completed(before=1020)
+        self.assertEqual(seq, 5)
+        self.assertEqual([ts for ts, _, _ in items], range(1005, 1020))
+
+    def test_collecting_while_draining(self):
+        store = SealingValueStore(numeric=True)
+        self.collect(store, 20)
+        seq, items = store.get_completed()
+        self.collect(store, 20, start=20)
+        store.acknowledge(seq + len(items))
+
+        seq, items = store.get_completed()
+        self.assertEqual(seq, 20)
+        self.assertEqual([value for _, _, value in items], [float(i) for i in range(20, 40)])
+
+    def test_non_numeric_store(self):
+        store = ValueStore(de_dupe=True)
+        store.collect("state", "a", ts=1)
+        store.collect("state", "a", ts=2)
+        store.collect("state", "b", ts=3)
+
+        seq, items = store.get_completed()
+        self.assertEqual(items, [(1, "state", "a"), (3, "state", "b")])
+        store.acknowledge(seq + len(items))
+        self.assertEqual(len(store), 0)
+
+if __name__ == "__main__":
+    unittest.main()